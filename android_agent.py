@@ -1,10 +1,30 @@
+import atexit
 import os
-import requests
-import subprocess
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from executor import CommandExecutor
+from file_tools import DirectoryCache, list_files, read_file
+from conversations import ConversationRegistry
+from context_manager import ContextManager, TokenCounter, tools_token_count
+from llm_pool import Backend, LLMPool
+from media import Image, MediaPipeline
+from metrics import TimedStorage, format_stats, metrics
+from scheduler import MISFIRE_RUN_ONCE, Scheduler, next_daily_run, parse_time
+from prompt_builder import build_messages, cache_params, history_window, number_history, prompt_cache_stats
+from response_cache import ResponseCache
+from retrieval import MemoryRetriever
+from router import DEFAULT_ROUTES, compile_routes, route_command
+from sms_poller import AdaptivePoller, fetch_new_messages
+from sms_queue import SmsQueue
+from sms_sender import SmsSender
+from task_batch import TaskBatch
+from storage import CachedStorage, load_json, migrate_json_files, open_storage
+from tool_cache import ToolCache
+from tool_selection import ToolSelector
+
 # --- KONFIGURASJON ---
 SERVER_URL = "http://local-llama-cpp:5034/v1/chat/completions"
 MODEL_NAME = "qwen2.5"
@@ -16,10 +36,125 @@ STATE_FILE = os.path.join(DATA_DIR, "state.json")
 HISTORY_FILE = os.path.join(DATA_DIR, "history.json")
 TASKS_FILE = os.path.join(DATA_DIR, "tasks.json")
 MEMORY_FILE = os.path.join(DATA_DIR, "user_profile.json")
+ROUTES_FILE = os.path.join(DATA_DIR, "routes.json")  # egne hurtigkommandoer, sjekkes før de innebygde
+
+STORAGE_BACKEND = "sqlite"  # "sqlite" (WAL, henry.db) eller "json" (én fil per nøkkel)
+STORAGE_FILES = {
+    "memory": "user_profile.json",
+    "notes": "notes.json",
+    "state": "state.json",
+    "history": "history.json",
+    "tasks": "tasks.json"
+}
+# Nøkler som holdes i minnet og skrives samlet etter STORAGE_FLUSH_DELAY sekunder. SMS-køen står
+# utenfor, så meldinger er lagret før innboksmerket flyttes
+STORAGE_CACHED_KEYS = {"memory", "notes", "state", "history", "history_summary", "tasks"}
+STORAGE_FLUSH_DELAY = 2.0
+
+LLM_CONNECT_TIMEOUT = 5  # sekunder for å opprette forbindelse til serveren
+LLM_FIRST_TOKEN_TIMEOUT = 180  # sekunder uten data før første token (prompt-prosessering)
+LLM_MAX_GENERATION_TIME = 600  # øvre grense for en hel generering
+LLM_STREAM = True
+
+LLM_SLOT_ID = 0  # llama.cpp-slot som forespørslene festes til, slik at KV-cachen gjenbrukes. None for å la serveren velge
+LLM_SLOTS = 1  # antall parallelle slots på llama.cpp-serveren (--parallel)
+# SMS-er som behandles samtidig, fra ulike samtaler; hver arbeider får sin egen slot så langt det finnes.
+# Meldinger i samme samtale behandles alltid én om gangen
+SMS_WORKERS = max(2, LLM_SLOTS)
+# Kontakter fra profilen kan også skrive til Henry, men får bare disse verktøyene (pluss "tools"
+# på kontakten). send_sms går alltid tilbake til kontakten selv.
+CONTACT_TOOLS = {"send_sms"}
+
+# OpenAI-kompatible backends. roles begrenser hva en backend brukes til (chat, tools, summary);
+# uten roles tar den alt. Forespørsler rutes etter observert latens, kø og kontekststørrelse,
+# og går videre til neste backend hvis en feiler.
+LLM_BACKENDS = [
+    {"name": "lokal", "url": SERVER_URL, "model": MODEL_NAME, "slots": LLM_SLOTS},
+    # {"name": "liten", "url": "http://local-llama-cpp:5035/v1/chat/completions", "model": "qwen2.5-3b", "roles": ["chat", "summary"]},
+]
+LLM_HEALTH_INTERVAL = 30  # sekunder mellom helsesjekker
+
+SMS_POLL_FAST_INTERVAL = 2  # sekunder mellom sjekker rett etter aktivitet
+SMS_POLL_MAX_INTERVAL = 60  # lengste pause når innboksen er stille
+SMS_POLL_ACTIVE_WINDOW = 120  # hvor lenge vi holder raskt tempo etter siste aktivitet
+SMS_POLL_PAGE_SIZE = 5  # første side per sjekk; dobles ved behov til alt nytt er hentet
+
+# Utgående SMS sendes fra en kø. Android advarer når en app sender over 30 SMS på 30 minutter,
+# så køen holder seg under det (i deler: lange meldinger deles ved 160 GSM-7- eller 70 UCS-2-tegn)
+SMS_SEND_RATE = 30
+SMS_SEND_PERIOD = 1800  # sekunder
+SMS_SEND_MIN_INTERVAL = 1.0  # sekunder mellom to sendinger
+SMS_SEND_RETRIES = 3
+SMS_SEND_BACKOFF = 5  # sekunder før første nye forsøk, dobles for hvert forsøk
+SMS_DEDUPE_WINDOW = 60  # like meldinger til samme nummer innen dette vinduet sendes bare én gang
+
+TOOL_SELECTION_ENABLED = True  # send bare verktøyskjemaene som er relevante for instruksjonen
+TOOL_SELECTION_TOP_K = 4  # treff som avgjør nivå; modellen kan be om flere via request_tools
+# Faste verktøynivåer, hvert nivå legges til det forrige, og resten av verktøyene er siste nivå.
+# Skjemaene står først i promptet, så hver gang blokken endres må hele promptet evalueres på nytt.
+# Med bare samtale (send_sms) og alt er blokken lik forrige forespørsel langt oftere enn med flere nivåer
+TOOL_TIERS = [
+    ["send_sms"]
+]
+
+FAST_PATH_ENABLED = True  # svar på enkle kommandoer direkte uten LLM
+
+RESPONSE_CACHE_ENABLED = True  # gjenbruk svar på gjentatte spørsmål så lenge minner/oppgaver er uendret
+RESPONSE_CACHE_TTL = 24 * 3600  # sekunder
+RESPONSE_CACHE_MAX_ENTRIES = 200
 
 MAX_HISTORY_ITEMS = 30
+HISTORY_CONTEXT_ITEMS = 12
+HISTORY_CONTEXT_BLOCK = 6  # historikkvinduet flyttes i blokker for å holde prompt-prefiksen stabil
+CONTEXT_TOKEN_BUDGET = 6000  # tokens til meldinger og verktøyskjemaer, la resten av n_ctx være til svaret
+TOOL_RESULT_TOKEN_LIMIT = 600  # lengre verktøyresultater kuttes i midten
+TOKENIZE_VIA_SERVER = True  # tell tokens med serverens /tokenize, ellers lokalt anslag
+SUMMARY_MIN_ENTRIES = 6  # antall meldinger utenfor historikkvinduet før de oppsummeres
+LLM_SUMMARY_SLOT_ID = None  # egen slot for oppsummering, så den ikke fortrenger hovedslotens KV-cache
+MEMORY_TOKEN_BUDGET = 400  # maks anslåtte tokens for notater og kontakter hentet per forespørsel
+MEMORY_TOP_K = 8  # maks antall notater og kontakter som hentes, før tokenbudsjettet kuttes
 MAX_TOOL_STEPS = 8
 
+METRICS_PROM_FILE = os.path.join(DATA_DIR, "metrics.prom")  # Prometheus textfile, f.eks. for node_exporter
+METRICS_JSONL_FILE = os.path.join(DATA_DIR, "metrics.jsonl")  # ett øyeblikksbilde per linje
+METRICS_EXPORT_INTERVAL = 60  # sekunder
+
+# Hvor lenge resultater fra trege Termux:API-verktøy gjenbrukes (ttl), og hvor gammel en verdi
+# kan være og fortsatt brukes hvis en oppdatering feiler (max_stale). Sekunder.
+TOOL_CACHE_POLICIES = {
+    "get_battery_status": {"ttl": 60, "max_stale": 600},
+    "get_wifi_info": {"ttl": 30, "max_stale": 300},
+    "get_device_info": {"ttl": 3600, "max_stale": 86400},
+    "get_location": {"ttl": 120, "max_stale": 1800}
+}
+
+TERMUX_WORKERS = 4  # maks antall samtidige Termux:API-prosesser
+TERMUX_DEFAULT_TIMEOUT = 20  # sekunder
+TERMUX_TIMEOUTS = {
+    "termux-location": 90,
+    "termux-camera-photo": 30,
+    "termux-sms-send": 30,
+    "termux-sms-list": 20
+}
+
+READ_FILE_MAX_LINES = 200  # øvre grense for length i read_file
+FILE_TOOL_MAX_CHARS = 4000  # lengre svar fra read_file kuttes og gir offset for neste side
+LIST_FILES_PAGE_SIZE = 50
+LIST_FILES_CACHE_TTL = 10  # sekunder; mappen leses også på nytt når mtime endres
+
+MMS_MAX_BYTES = 300 * 1024  # mange operatører avviser MMS over ca. 300 kB
+MMS_MAX_SIDE = 1600  # piksler på lengste side før komprimering
+
+TOOL_WORKERS = 4  # maks antall verktøykall fra samme LLM-steg som kjøres samtidig
+# Verktøy med sideeffekter kjøres alltid ett og ett i rekkefølgen modellen ba om
+SIDE_EFFECT_TOOLS = {"send_sms", "send_mms", "take_photo", "set_clipboard", "schedule_task", "cancel_task", "update_memory"}
+# Verktøy uten sideeffekter; like kall fra oppgaver som forfaller samtidig utføres bare én gang
+READ_ONLY_TOOLS = {
+    "get_battery_status", "get_wifi_info", "get_location", "get_device_info", "get_clipboard",
+    "list_files", "read_file", "list_tasks", "get_agent_stats"
+}
+TASK_WORKERS = 4  # maks antall planlagte oppgaver som kjøres samtidig
+
 AGENT_HARDWARE = "generisk Android"  # Endre til spesifikk modell hvis ønskelig, eller la det være generisk
 
 DEFAULT_MEMORY = {
@@ -44,83 +179,198 @@ DEFAULT_MEMORY = {
     "notes": []
 }
 
+llm_pool = LLMPool(
+    [
+        Backend(
+            **backend,
+            connect_timeout=LLM_CONNECT_TIMEOUT,
+            first_token_timeout=LLM_FIRST_TOKEN_TIMEOUT,
+            max_generation_time=LLM_MAX_GENERATION_TIME,
+            pool_size=max(4, backend.get("slots", 1) + 1),
+            stream=LLM_STREAM
+        )
+        for backend in LLM_BACKENDS
+    ],
+    health_interval=LLM_HEALTH_INTERVAL
+)
+
+SYSTEM_PROMPT = (
+    f"Du er en AI agent ved navn Henry. Maskinvaren din er en {AGENT_HARDWARE}. "
+    "Kjernen din kjører i applikasjonen Termux, og du kan bruke verktøy for å interagere med telefonens funksjoner. "
+    "Du får oppgaver via SMS og må alltid sende endelige svar via verktøyet send_sms. "
+    "Du kan bruke flere verktøy over flere steg. "
+    "Hold svar korte og presise. Hvis noe er uklart, be om presisering via send_sms. "
+    "Skill tydelig mellom intern oppgaveutførelse og SMS-svar. "
+    "Når du planlegger, bruk verktøy, og til slutt bruk send_sms med et konsist svar. "
+    "Hvis brukeren ber om periodiske oppgaver, bruk schedule_task og beskriv hvordan {last_result} kan brukes. "
+    "For tidsstyrte oppgaver: schedule_type=interval, daily (HH:MM), eller once (ISO8601 run_at). "
+    "Personlighet: Hjelpsom, positiv og litt sarkastisk."
+)
+
 DEFAULT_STATE = {
     "last_checked_sms_id": 0
 }
 
+_storage = None
+_profile_mtime = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        backend = TimedStorage(open_storage(STORAGE_BACKEND, DATA_DIR, STORAGE_FILES), metrics)
+        _storage = CachedStorage(backend, STORAGE_CACHED_KEYS, flush_delay=STORAGE_FLUSH_DELAY)
+        atexit.register(_storage.flush)
+    return _storage
+
+
 def ensure_data_files():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(MEMORY_FILE):
-        save_json(MEMORY_FILE, DEFAULT_MEMORY)
-    if not os.path.exists(STATE_FILE):
-        save_json(STATE_FILE, DEFAULT_STATE)
-    if not os.path.exists(HISTORY_FILE):
-        save_json(HISTORY_FILE, [])
-    if not os.path.exists(TASKS_FILE):
-        save_json(TASKS_FILE, [])
-
-
-def load_json(path, default):
+    storage = get_storage()
+    migrated = migrate_json_files(
+        storage,
+        documents={"memory": MEMORY_FILE, "state": STATE_FILE, "tasks": TASKS_FILE},
+        lists={"history": (HISTORY_FILE, None), "notes": (MEMORY_FILE, "notes")}
+    )
+    for path in migrated:
+        print(f"Migrerte {os.path.basename(path)} til {STORAGE_BACKEND}-lagring")
+
+    # Notater lagres som en egen liste, så nye notater kan legges til uten å skrive hele profilen
+    memory = storage.get("memory")
+    if memory is None:
+        storage.put("memory", {key: value for key, value in DEFAULT_MEMORY.items() if key != "notes"})
+    elif "notes" in memory:
+        memory.pop("notes")
+        storage.put("memory", memory)
+    if not storage.exists("state"):
+        storage.put("state", DEFAULT_STATE)
+    if not storage.exists("tasks"):
+        storage.put("tasks", [])
+
+
+def sync_profile():
+    # Med SQLite kopieres user_profile.json inn i henry.db ved første oppstart. Filen er fortsatt
+    # stedet man redigerer profil og kontakter, så den leses inn på nytt når den får ny mtime
+    global _profile_mtime
+    if STORAGE_BACKEND == "json":
+        return
     try:
-        with open(path, "r", encoding="utf-8") as handle:
-            return json.load(handle)
-    except Exception:
-        return default
+        mtime = os.stat(MEMORY_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return
+    storage = get_storage()
+    if _profile_mtime is None:
+        _profile_mtime = storage.get("profile_mtime")
+    if mtime == _profile_mtime:
+        return
+    profile = load_json(MEMORY_FILE, None)
+    if isinstance(profile, dict):
+        # Notatene ligger i sin egen liste etter migreringen og hentes ikke inn igjen herfra
+        storage.put("memory", {key: value for key, value in profile.items() if key != "notes"})
+        response_cache.invalidate("memory")
+    _profile_mtime = mtime
+    storage.put("profile_mtime", mtime)
+
 
+def load_memory():
+    sync_profile()
+    return get_storage().get("memory", DEFAULT_MEMORY)
 
-def save_json(path, payload):
-    with open(path, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle, ensure_ascii=False, indent=2)
 
+termux_executor = CommandExecutor(
+    max_workers=TERMUX_WORKERS,
+    default_timeout=TERMUX_DEFAULT_TIMEOUT,
+    timeouts=TERMUX_TIMEOUTS
+)
 
-def call_termux(command):
+
+def call_termux(argv, timeout=None, strict=False):
     try:
-        result = subprocess.run(command, capture_output=True, text=True, shell=True)
-        return result.stdout.strip()
+        with metrics.timer("termux", command=os.path.basename(argv[0])):
+            return termux_executor.run(argv, timeout)
     except Exception as e:
+        metrics.inc("termux_errors", command=os.path.basename(argv[0]))
+        if strict:
+            raise
         return str(e)
 
+
+def call_termux_async(argv, timeout=None):
+    return termux_executor.submit(argv, timeout)
+
 def execute_tool(name, args):
+    try:
+        # Verktøynavnet kommer fra modellen; ukjente navn samles under én label så serien ikke vokser fritt
+        label = name if name in tool_selector.names else "unknown"
+        with metrics.timer("tool", tool=label):
+            return tool_cache.call(name, args, lambda: execute_tool_uncached(name, args))
+    except Exception as e:
+        return str(e)
+
+
+def execute_tool_uncached(name, args):
     if name == "get_battery_status":
-        return call_termux("termux-battery-status")
+        return call_termux(["termux-battery-status"], strict=True)
     if name == "get_wifi_info":
-        return call_termux("termux-wifi-connectioninfo")
+        return call_termux(["termux-wifi-connectioninfo"], strict=True)
     if name == "get_location":
-        return call_termux("termux-location")
+        return call_termux(["termux-location"], strict=True)
     if name == "get_device_info":
-        return call_termux("termux-telephony-deviceinfo")
+        return call_termux(["termux-telephony-deviceinfo"], strict=True)
     if name == "get_clipboard":
-        return call_termux("termux-clipboard-get")
+        return call_termux(["termux-clipboard-get"])
     if name == "set_clipboard":
         value = args.get("text", "")
-        call_termux(f"termux-clipboard-set '{value}'")
+        call_termux(["termux-clipboard-set", value])
         return "Clipboard oppdatert"
     if name == "send_sms":
         num = args.get("number") or MY_NUMBER
         msg = args.get("message", "")
-        call_termux(f'termux-sms-send -n {num} "{msg}"')
+        if not sms_sender.send(num, msg):
+            return f"SMS til {num} ikke sendt: tom eller allerede sendt"
         return f"SMS sendt til {num}"
     if name == "send_mms":
         num = args.get("number") or MY_NUMBER
         filepath = args.get("file_path")
         msg = args.get("message", "")
         if filepath:
-            call_termux(f'termux-sms-send -n {num} -a "{filepath}" "{msg}"')
-            return f"MMS sendt til {num}: {filepath}"
+            filepath = os.path.expanduser(filepath)
+            if not os.path.exists(filepath):
+                return f"MMS feilet: fant ikke {filepath}"
+            # Bildet komprimeres i bakgrunnen og legges i sendekøen når det er klart, så MMS får
+            # samme ratebegrensning, nye forsøk og duplikatsjekk som SMS
+            media_pipeline.send_when_ready(filepath, lambda attachment: sms_sender.send(num, msg, attachment))
+            return f"MMS sendes til {num}: {filepath}"
         return "MMS feilet: mangler filsti"
     if name == "take_photo":
         filename = f"photo_{int(time.time())}.jpg"
         target = os.path.expanduser(f"~/storage/downloads/{filename}")
-        call_termux(f"termux-camera-photo -c 0 '{target}'")
+        call_termux(["termux-camera-photo", "-c", "0", target])
+        if os.path.exists(target):
+            # Start komprimeringen med en gang, så den ofte er ferdig før send_mms kalles
+            media_pipeline.prepare(target)
         return target
     if name == "list_files":
-        path = args.get("path", "~/storage")
-        return call_termux(f"ls -al {path}")
+        return list_files(
+            directory_cache,
+            args.get("path") or "~/storage",
+            offset=int(args.get("offset") or 0),
+            limit=min(int(args.get("limit") or LIST_FILES_PAGE_SIZE), LIST_FILES_PAGE_SIZE),
+            sort=args.get("sort") or "name",
+            pattern=args.get("pattern"),
+            descending=bool(args.get("descending", False))
+        )
     if name == "read_file":
         path = args.get("path", "")
         if not path:
             return "Mangler filsti"
-        return call_termux(f"sed -n '1,200p' {path}")
+        return read_file(
+            path,
+            offset=int(args.get("offset") or 0),
+            length=min(int(args.get("length") or READ_FILE_MAX_LINES), READ_FILE_MAX_LINES),
+            pattern=args.get("pattern"),
+            max_chars=FILE_TOOL_MAX_CHARS
+        )
     if name == "schedule_task":
         return schedule_task(args)
     if name == "list_tasks":
@@ -129,8 +379,67 @@ def execute_tool(name, args):
         return cancel_task(args)
     if name == "update_memory":
         return update_memory(args)
+    if name == "get_agent_stats":
+        return get_agent_stats(args)
     return "Ukjent verktøy"
 
+tool_cache = ToolCache(TOOL_CACHE_POLICIES)
+directory_cache = DirectoryCache(ttl=LIST_FILES_CACHE_TTL)
+media_pipeline = MediaPipeline(max_bytes=MMS_MAX_BYTES, max_side=MMS_MAX_SIDE)
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
+def run_tool_calls(tool_calls, handlers=None, allowed=None):
+    calls = []
+    for tool_call in tool_calls:
+        name = tool_call["function"]["name"]
+        try:
+            args = json.loads(tool_call["function"]["arguments"] or "{}")
+        except ValueError:
+            args = None
+        calls.append((name, args))
+
+    def run(index):
+        name, args = calls[index]
+        if args is None:
+            return "Ugyldige argumenter"
+        if handlers and name in handlers:
+            return handlers[name](args)
+        # Modellen kan kalle verktøy som ikke var i skjemaene den fikk, så listen må sjekkes her også
+        if allowed is not None and name not in allowed:
+            return f"Verktøyet {name} er ikke tilgjengelig"
+        print(f"Henry kjører verktøy: {name}")
+        return execute_tool(name, args)
+
+    def run_in_order(indexes):
+        return [run(index) for index in indexes]
+
+    if len(calls) == 1:
+        return [run(0)]
+
+    ordered = [index for index, (name, _) in enumerate(calls) if name in SIDE_EFFECT_TOOLS]
+    futures = {
+        index: tool_executor.submit(run, index)
+        for index, (name, _) in enumerate(calls) if name not in SIDE_EFFECT_TOOLS
+    }
+    ordered_future = tool_executor.submit(run_in_order, ordered) if ordered else None
+
+    results = [None] * len(calls)
+    for index, future in futures.items():
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            results[index] = f"Verktøyfeil: {e}"
+    if ordered_future is not None:
+        try:
+            for index, result in zip(ordered, ordered_future.result()):
+                results[index] = result
+        except Exception as e:
+            for index in ordered:
+                if results[index] is None:
+                    results[index] = f"Verktøyfeil: {e}"
+    return results
+
 tools = [
     {
         "type": "function",
@@ -229,11 +538,16 @@ tools = [
         "type": "function",
         "function": {
             "name": "list_files",
-            "description": "Lister filer i en mappe",
+            "description": "Lister filer i en mappe, side for side",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "path": {"type": "string", "description": "Mappe å liste"}
+                    "path": {"type": "string", "description": "Mappe å liste"},
+                    "pattern": {"type": "string", "description": "Filnavnmønster, f.eks. *.jpg"},
+                    "sort": {"type": "string", "description": "name, size eller mtime"},
+                    "descending": {"type": "boolean", "description": "Største/nyeste først"},
+                    "offset": {"type": "integer", "description": "Hopp over så mange oppføringer"},
+                    "limit": {"type": "integer", "description": "Maks antall oppføringer"}
                 }
             }
         }
@@ -242,11 +556,14 @@ tools = [
         "type": "function",
         "function": {
             "name": "read_file",
-            "description": "Leser de første linjene i en fil",
+            "description": "Leser linjer fra en fil, eller søker etter linjer som passer et mønster",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "path": {"type": "string", "description": "Filsti"}
+                    "path": {"type": "string", "description": "Filsti"},
+                    "offset": {"type": "integer", "description": "Første linje (fra 0); negativ teller fra slutten. Med pattern: treff å hoppe over"},
+                    "length": {"type": "integer", "description": "Maks antall linjer"},
+                    "pattern": {"type": "string", "description": "Regulært uttrykk, uten hensyn til store/små bokstaver"}
                 },
                 "required": ["path"]
             }
@@ -265,6 +582,10 @@ tools = [
                     "schedule_type": {"type": "string", "description": "interval, daily, once"},
                     "daily_time": {"type": "string", "description": "HH:MM for daglige oppgaver"},
                     "run_at": {"type": "string", "description": "ISO8601 tidspunkt for engangsoppgaver"},
+                    "coalesce_sms": {
+                        "type": "boolean",
+                        "description": "Slå sammen send_sms til samme nummer med andre oppgaver som kjører samtidig"
+                    },
                     "actions": {
                         "type": "array",
                         "items": {
@@ -316,41 +637,131 @@ tools = [
                 "required": ["note"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_agent_stats",
+            "description": "Henter Henrys ytelsesstatistikk: svartider per steg, LLM-tokens og cache-treff",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filter": {"type": "string", "description": "Vis bare målinger som starter med dette, f.eks. llm eller tool"}
+                }
+            }
+        }
     }
 ]
 
-def append_history(role, content):
-    history = load_json(HISTORY_FILE, [])
-    history.append({
+tool_selector = ToolSelector(tools, tiers=TOOL_TIERS, top_k=TOOL_SELECTION_TOP_K)
+
+
+def history_key(key=None):
+    # Eierens samtale bruker de opprinnelige nøklene, andre samtaler får sine egne
+    return f"history.{key}" if key else "history"
+
+
+def summary_key(key=None):
+    return f"history_summary.{key}" if key else "history_summary"
+
+
+def load_history(key=None, limit=None):
+    storage = get_storage()
+    history = storage.items(history_key(key), limit=limit)
+    if any("seq" not in entry for entry in history):
+        history = number_history(history, len(storage.items(history_key(key))) - len(history))
+    return history
+
+
+def append_history(role, content, key=None):
+    storage = get_storage()
+    last = load_history(key, limit=1)
+    seq = last[0]["seq"] + 1 if last else 0
+    storage.append(history_key(key), {
         "role": role,
         "content": content,
-        "timestamp": datetime.utcnow().isoformat()
-    })
-    history = history[-MAX_HISTORY_ITEMS:]
-    save_json(HISTORY_FILE, history)
+        "timestamp": datetime.utcnow().isoformat(),
+        "seq": seq
+    }, max_items=MAX_HISTORY_ITEMS)
+
+
+def get_history_context(key=None):
+    history = load_history(key, limit=HISTORY_CONTEXT_ITEMS)
+    window = history_window(history, HISTORY_CONTEXT_ITEMS, HISTORY_CONTEXT_BLOCK)
+    summarized_until = context_manager.summarized_until(key)
+    return [entry for entry in window if entry.get("seq", 0) > summarized_until]
+
+
+def pending_history_for_summary(key=None):
+    history = load_history(key, limit=MAX_HISTORY_ITEMS)
+    window = history_window(history, HISTORY_CONTEXT_ITEMS, HISTORY_CONTEXT_BLOCK)
+    if not window:
+        return []
+    window_start = window[0].get("seq", 0)
+    summarized_until = context_manager.summarized_until(key)
+    return [entry for entry in history if summarized_until < entry.get("seq", 0) < window_start]
 
 
-def get_history_context():
-    history = load_json(HISTORY_FILE, [])
-    return history[-12:]
+def summarize_history(previous, transcript):
+    messages = [
+        {"role": "system", "content": (
+            "Oppsummer samtalen mellom brukeren og Henry kort på norsk. "
+            "Behold fakta, avtaler, beslutninger og åpne spørsmål. Maks 120 ord."
+        )},
+        {"role": "user", "content": f"Tidligere sammendrag: {previous or 'ingen'}\n\nNye meldinger:\n{transcript}"}
+    ]
+    response = llm_pool.complete(messages, role="summary", **cache_params(LLM_SUMMARY_SLOT_ID))
+    return response["choices"][0]["message"].get("content")
+
+
+def recall_memory(instruction):
+    memory = load_memory()
+    return memory_retriever.select(memory, instruction, MEMORY_TOKEN_BUDGET, MEMORY_TOP_K)
 
 
 def update_memory(args):
-    memory = load_json(MEMORY_FILE, DEFAULT_MEMORY)
     note = args.get("note", "").strip()
     if not note:
         return "Ingen notat oppgitt"
-    memory.setdefault("notes", []).append({
+    entry = {
         "note": note,
         "timestamp": datetime.utcnow().isoformat()
-    })
-    save_json(MEMORY_FILE, memory)
+    }
+    get_storage().append("notes", entry)
+    memory_retriever.add_note(entry)
+    response_cache.invalidate("memory")
     return "Minne lagret"
 
 
+def get_agent_stats(args):
+    prefix = args.get("filter")
+    lines = [format_stats(metrics.snapshot(), names=[prefix] if prefix else None)]
+    for name, counters in sorted(tool_cache.snapshot().items()):
+        lines.append(f"Cache {name}: {counters['hits']} treff, {counters['misses']} bom, {counters['stale']} gamle")
+    for backend in llm_pool.snapshot():
+        latency = "ukjent" if backend["latency"] is None else f"{backend['latency']:.1f} s"
+        lines.append(
+            f"LLM {backend['name']}: {'oppe' if backend['healthy'] else 'nede'}, "
+            f"latens {latency}, {backend['in_flight']} aktive"
+        )
+    return "\n".join(lines)
+
+
+memory_retriever = MemoryRetriever(load_notes=lambda: get_storage().items("notes"))
+
+context_manager = ContextManager(
+    TokenCounter(tokenize=llm_pool.tokenize if TOKENIZE_VIA_SERVER else None),
+    budget=CONTEXT_TOKEN_BUDGET,
+    tool_result_tokens=TOOL_RESULT_TOKEN_LIMIT,
+    summarize=summarize_history,
+    load_summary=lambda key: get_storage().get(summary_key(key)),
+    save_summary=lambda key, summary: get_storage().put(summary_key(key), summary),
+    min_summary_entries=SUMMARY_MIN_ENTRIES
+)
+
+
 def schedule_task(args):
-    tasks = load_json(TASKS_FILE, [])
-    task_id = f"task_{int(time.time())}"
+    task_id = scheduler.new_task_id(f"task_{int(time.time())}")
     schedule_type = args.get("schedule_type", "interval")
     now = datetime.utcnow()
     task = {
@@ -361,6 +772,8 @@ def schedule_task(args):
         "daily_time": args.get("daily_time"),
         "run_at": args.get("run_at"),
         "actions": args.get("actions", []),
+        "coalesce_sms": bool(args.get("coalesce_sms", False)),
+        "misfire_policy": args.get("misfire_policy", MISFIRE_RUN_ONCE),
         "last_run": None,
         "next_run": None,
         "enabled": True
@@ -376,10 +789,10 @@ def schedule_task(args):
         daily_time = args.get("daily_time")
         if not daily_time or len(daily_time.split(":")) != 2:
             return "Ugyldig tidspunkt for daily (HH:MM)"
-        hour, minute = daily_time.split(":")
-        next_run = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
-        if next_run <= now:
-            next_run += timedelta(days=1)
+        try:
+            next_run = next_daily_run(daily_time, now)
+        except ValueError:
+            return "Ugyldig tidspunkt for daily (HH:MM)"
         task["daily_time"] = daily_time
         task["next_run"] = next_run.isoformat()
     elif schedule_type == "once":
@@ -387,7 +800,7 @@ def schedule_task(args):
         if not run_at:
             return "Ugyldig tidspunkt for once (ISO8601)"
         try:
-            next_run = datetime.fromisoformat(run_at)
+            next_run = parse_time(run_at)
         except ValueError:
             return "Ugyldig tidspunkt for once (ISO8601)"
         task["run_at"] = run_at
@@ -395,191 +808,391 @@ def schedule_task(args):
     else:
         return "Ugyldig schedule_type"
 
-    tasks.append(task)
-    save_json(TASKS_FILE, tasks)
+    scheduler.add(task)
     return f"Oppgave planlagt: {task_id}"
 
 
 def list_tasks():
-    tasks = load_json(TASKS_FILE, [])
-    return json.dumps(tasks, ensure_ascii=False, indent=2)
+    return json.dumps(scheduler.list(), ensure_ascii=False, indent=2)
 
 
 def cancel_task(args):
     task_id = args.get("task_id")
-    tasks = load_json(TASKS_FILE, [])
-    updated = False
-    for task in tasks:
-        if task.get("id") == task_id:
-            task["enabled"] = False
-            updated = True
-    save_json(TASKS_FILE, tasks)
-    return "Oppgave deaktivert" if updated else "Fant ikke oppgave"
+    return "Oppgave deaktivert" if scheduler.cancel(task_id) else "Fant ikke oppgave"
+
+
+def run_task_actions(task, call_tool=execute_tool):
+    last_result = ""
+    for action in task.get("actions", []):
+        tool_name = action.get("tool_name")
+        tool_args = action.get("tool_args", {})
+        resolved_args = {}
+        for key, value in tool_args.items():
+            if isinstance(value, str):
+                resolved_args[key] = value.replace("{last_result}", last_result)
+            else:
+                resolved_args[key] = value
+        last_result = call_tool(tool_name, resolved_args)
+
+
+def run_task_batch(batch):
+    task_batch = TaskBatch(execute_tool, READ_ONLY_TOOLS, task_executor, default_number=MY_NUMBER)
+    stats = task_batch.run(batch, lambda task, call_tool: scheduler.run_task(task, call_tool))
+    metrics.inc("task_tool_calls_deduplicated", stats["deduplicated"])
+    metrics.inc("task_sms_coalesced", stats["coalesced"])
 
 
 def run_scheduled_tasks():
-    tasks = load_json(TASKS_FILE, [])
-    now = datetime.utcnow()
-    changed = False
-
-    for task in tasks:
-        if not task.get("enabled", True):
-            continue
-        next_run = task.get("next_run")
-        if not next_run:
-            continue
-        if datetime.fromisoformat(next_run) > now:
-            continue
-
-        last_result = ""
-        for action in task.get("actions", []):
-            tool_name = action.get("tool_name")
-            tool_args = action.get("tool_args", {})
-            resolved_args = {}
-            for key, value in tool_args.items():
-                if isinstance(value, str):
-                    resolved_args[key] = value.replace("{last_result}", last_result)
-                else:
-                    resolved_args[key] = value
-            last_result = execute_tool(tool_name, resolved_args)
-
-        task["last_run"] = now.isoformat()
-        schedule_type = task.get("schedule_type", "interval")
-        if schedule_type == "interval":
-            interval_minutes = int(task.get("interval_minutes", 0))
-            task["next_run"] = (now + timedelta(minutes=interval_minutes)).isoformat()
-        elif schedule_type == "daily":
-            daily_time = task.get("daily_time", "06:00")
-            hour, minute = daily_time.split(":")
-            next_run_dt = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
-            if next_run_dt <= now:
-                next_run_dt += timedelta(days=1)
-            task["next_run"] = next_run_dt.isoformat()
-        elif schedule_type == "once":
-            task["enabled"] = False
+    return scheduler.run_due()
+
+
+task_executor = ThreadPoolExecutor(max_workers=TASK_WORKERS, thread_name_prefix="task")
+
+scheduler = Scheduler(
+    load_tasks=lambda: get_storage().get("tasks", []),
+    save_tasks=lambda tasks: (get_storage().put("tasks", tasks), response_cache.invalidate("tasks")),
+    run_task=run_task_actions,
+    on_run=lambda executed: sms_poller.wake(),
+    run_batch=run_task_batch
+)
+
+def send_reply(text, number=None):
+    sms_sender.send(number or MY_NUMBER, text)
+
+
+def send_sms_part(number, text, attachment=None):
+    argv = ["termux-sms-send", "-n", number]
+    if attachment:
+        argv += ["-a", attachment]
+    with metrics.timer("sms_send"):
+        call_termux(argv + [text], strict=True)
+
+
+def record_llm_step(response):
+    backend = response.get("backend", "ukjent")
+    usage = response.get("usage") or {}
+    latency = response.get("latency") or {}
+    timings = response.get("timings") or {}
+    if latency.get("total") is not None:
+        metrics.observe("llm_step", latency["total"], backend=backend)
+    if latency.get("first_token") is not None:
+        metrics.observe("llm_first_token", latency["first_token"], backend=backend)
+    metrics.inc("llm_prompt_tokens", usage.get("prompt_tokens") or 0, backend=backend)
+    metrics.inc("llm_completion_tokens", usage.get("completion_tokens") or 0, backend=backend)
+    # llama.cpp rapporterer genereringshastigheten selv; ellers anslås den fra latensen
+    tokens_per_second = timings.get("predicted_per_second")
+    generation_time = (latency.get("total") or 0) - (latency.get("first_token") or 0)
+    if tokens_per_second is None and usage.get("completion_tokens") and generation_time > 0:
+        tokens_per_second = usage["completion_tokens"] / generation_time
+    if tokens_per_second:
+        metrics.observe("llm_tokens_per_second", tokens_per_second, backend=backend)
+
+
+def process_llm_task(instruction, slot_id=LLM_SLOT_ID, conversation=None):
+    key = conversation["key"] if conversation else None
+    owner = conversation is None or conversation["owner"]
+    reply_number = MY_NUMBER if owner else conversation["number"]
+    system_prompt = SYSTEM_PROMPT
+    allowed_tools = None
+    if not owner:
+        system_prompt += (
+            f" Du snakker nå med {conversation['name']} ({conversation.get('relationship') or 'kontakt'}), ikke eieren. "
+            "Svar bare denne personen, og del ikke eierens notater eller private opplysninger."
+        )
+        allowed_tools = CONTACT_TOOLS | set(conversation.get("tools") or [])
+
+    with metrics.timer("prompt_build"):
+        if owner:
+            memory, recalled = recall_memory(instruction)
         else:
-            task["enabled"] = False
-        changed = True
-
-    if changed:
-        save_json(TASKS_FILE, tasks)
-
-def process_llm_task(instruction):
-    memory = load_json(MEMORY_FILE, DEFAULT_MEMORY)
-    history_context = get_history_context()
-    system_prompt = (
-        "Du er en AI agent ved navn Henry. Maskinvaren din er en {AGENT_HARDWARE}. "
-        "Kjernen din kjører i applikasjonen Termux, og du kan bruke verktøy for å interagere med telefonens funksjoner. "
-        "Du får oppgaver via SMS og må alltid sende endelige svar via verktøyet send_sms. "
-        "Du kan bruke flere verktøy over flere steg. "
-        "Hold svar korte og presise. Hvis noe er uklart, be om presisering via send_sms. "
-        "Skill tydelig mellom intern oppgaveutførelse og SMS-svar. "
-        "Når du planlegger, bruk verktøy, og til slutt bruk send_sms med et konsist svar. "
-        "Hvis brukeren ber om periodiske oppgaver, bruk schedule_task og beskriv hvordan {last_result} kan brukes. "
-        "For tidsstyrte oppgaver: schedule_type=interval, daily (HH:MM), eller once (ISO8601 run_at). "
-        "Personlighet: Hjelpsom, positiv og litt sarkastisk."
-    )
+            # Eierens profil, preferanser og kontakter (med numre) skal ikke inn i promptet til andre
+            memory = {"contact": {"name": conversation["name"], "relationship": conversation.get("relationship")}}
+            recalled = None
+        history_context = get_history_context(key)
+        messages = build_messages(
+            system_prompt, memory, history_context, instruction, recalled, context_manager.summary_text(key)
+        )
+    turn_start = len(messages) - 1
 
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.append({"role": "system", "content": f"MINNER: {json.dumps(memory, ensure_ascii=False)}"})
+    if TOOL_SELECTION_ENABLED:
+        active_tools = tool_selector.select(instruction)
+    else:
+        active_tools = set(tool_selector.names)
+    if allowed_tools is not None:
+        active_tools &= allowed_tools
 
-    for entry in history_context:
-        messages.append({"role": entry["role"], "content": entry["content"]})
-    messages.append({"role": "user", "content": instruction})
+    def request_tools(args):
+        nonlocal active_tools
+        active_tools, added = tool_selector.expand(active_tools, args.get("query"))
+        if allowed_tools is not None:
+            active_tools &= allowed_tools
+            added = [name for name in added if name in allowed_tools]
+        return f"Verktøy lagt til: {', '.join(added)}" if added else "Ingen nye verktøy"
 
-    append_history("user", instruction)
+    handlers = {"request_tools": request_tools}
+    if not owner:
+        handlers["send_sms"] = lambda args: execute_tool("send_sms", dict(args, number=reply_number))
+
+    append_history("user", instruction, key)
+    used_tools = []
+    reply = None
 
     for step in range(MAX_TOOL_STEPS):
         try:
-            response = requests.post(
-                SERVER_URL,
-                json={
-                    "model": MODEL_NAME,
-                    "messages": messages,
-                    "tools": tools,
-                    "tool_choice": "auto"
-                },
-                timeout=30
-            ).json()
+            step_tools = tool_selector.schemas(active_tools)
+            tools_tokens = tools_token_count(context_manager.counter, step_tools)
+            messages, turn_start = context_manager.fit(messages, turn_start, reserved=tools_tokens)
+            context_tokens = tools_tokens + sum(context_manager.counter.count_message(message) for message in messages)
+            # Rene samtalesvar kan gå til en liten modell, flerstegs verktøybruk til en større
+            role = "chat" if active_tools <= {"send_sms"} else "tools"
+            response = llm_pool.complete(
+                messages,
+                tools=step_tools,
+                tool_choice="auto",
+                role=role,
+                context_tokens=context_tokens,
+                **cache_params(slot_id)
+            )
+            record_llm_step(response)
+            cached, evaluated = prompt_cache_stats(response)
+            if cached is not None or evaluated is not None:
+                print(f"Prompt-cache: {cached} tokens gjenbrukt, {evaluated} evaluert")
 
             choice = response["choices"][0]["message"]
             messages.append(choice)
 
             if "tool_calls" in choice:
-                for tool_call in choice["tool_calls"]:
-                    name = tool_call["function"]["name"]
-                    args = json.loads(tool_call["function"]["arguments"])
-                    print(f"Henry kjører verktøy: {name}")
-                    result = execute_tool(name, args)
+                results = run_tool_calls(choice["tool_calls"], handlers=handlers, allowed=allowed_tools)
+                # Svarene legges til i samme rekkefølge som kallene, uansett når de ble ferdige
+                for tool_call, result in zip(choice["tool_calls"], results):
+                    record_tool_use(used_tools, tool_call, result)
                     messages.append({
                         "role": "tool",
                         "tool_call_id": tool_call.get("id"),
-                        "name": name,
-                        "content": str(result)
+                        "name": tool_call["function"]["name"],
+                        "content": context_manager.clip_tool_result(result)
                     })
                 continue
 
             if choice.get("content"):
                 print(f"Henry svarer: {choice['content']}")
-                append_history("assistant", choice["content"])
-                call_termux(f'termux-sms-send -n {MY_NUMBER} "{choice["content"]}"')
+                append_history("assistant", choice["content"], key)
+                send_reply(choice["content"], reply_number)
+                reply = choice["content"]
                 break
         except Exception as e:
             print(f"Feil under LLM-prosessering: {e}")
-            break
+            return None
 
+    # Svar sendt med send_sms-verktøyet til avsenderen teller også som svaret på instruksjonen
+    sms_replies = [
+        tool for tool in used_tools
+        if tool["name"] == "send_sms" and (not owner or tool["args"].get("number") in (None, "", MY_NUMBER))
+    ]
+    if reply is None and sms_replies:
+        reply = sms_replies[-1]["args"].get("message")
+    # Svarcachen deles ikke med kontakter, så eierens svar aldri havner hos andre
+    if RESPONSE_CACHE_ENABLED and reply and owner:
+        other_tools = [tool for tool in used_tools if tool not in sms_replies]
+        response_cache.store(instruction, reply, other_tools)
+    return reply
+
+
+def record_tool_use(used_tools, tool_call, result):
+    if tool_call["function"]["name"] == "request_tools":
+        return
+    try:
+        args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except ValueError:
+        return
+    used_tools.append({"name": tool_call["function"]["name"], "args": args, "result": result})
 
-def check_for_sms_commands(state):
-    raw_sms = call_termux("termux-sms-list -l 20")
-    if not raw_sms or raw_sms == "[]":
-        return None
 
+def list_sms_page(offset, limit):
+    raw_sms = call_termux(["termux-sms-list", "-t", "inbox", "-o", str(offset), "-l", str(limit)])
+    if not raw_sms:
+        return []
     try:
-        sms_list = json.loads(raw_sms)
-        sms_list = sorted(sms_list, key=lambda msg: int(msg.get("_id", 0)))
-        for msg in sms_list:
-            is_from_user = msg.get("number", "").replace(" ", "").endswith(MY_NUMBER[-8:])
-            is_inbox = msg.get("type") == "inbox"
-
-            if is_from_user and is_inbox:
-                current_id = int(msg.get("_id"))
-                if current_id > state["last_checked_sms_id"]:
-                    state["last_checked_sms_id"] = current_id
-                    save_json(STATE_FILE, state)
-                    return msg.get("body")
+        return json.loads(raw_sms)
+    except ValueError:
+        print(f"SMS Error: {raw_sms[:200]}")
+        return []
+
+
+def check_for_sms_commands(state):
+    try:
+        with metrics.timer("sms_poll"):
+            inbox = fetch_new_messages(list_sms_page, state["last_checked_sms_id"], SMS_POLL_PAGE_SIZE)
     except Exception as e:
         print(f"SMS Error: {e}")
-    return None
+        return []
+    if not inbox:
+        return []
+
+    new_messages = []
+    for msg in inbox:
+        conversation = conversations.lookup(msg.get("number", ""))
+        if conversation is not None and msg.get("type", "inbox") == "inbox":
+            new_messages.append({
+                "id": int(msg.get("_id")),
+                "number": msg.get("number"),
+                "conversation": conversation["key"],
+                "body": msg.get("body"),
+                "received": msg.get("received"),
+                "enqueued_at": time.time()
+            })
+
+    # Legg meldingene i den varige køen før vi flytter merket, så ingen går tapt ved krasj.
+    # Merket flyttes også forbi meldinger fra andre, så de ikke hentes på nytt ved neste sjekk
+    if new_messages:
+        sms_queue.enqueue(new_messages)
+    state["last_checked_sms_id"] = int(inbox[-1].get("_id"))
+    get_storage().put("state", state)
+    return new_messages
+
+
+def handle_sms(message, worker_index):
+    instruction = message.get("body")
+    if not instruction:
+        return
+    conversation = conversations.lookup(message.get("number", ""))
+    if conversation is None:
+        print(f"Ignorerer melding fra {message.get('number')}: ikke lenger en kontakt")
+        return
+    if message.get("enqueued_at"):
+        metrics.observe("queue_wait", max(0.0, time.time() - message["enqueued_at"]))
+    slot_id = None if LLM_SLOT_ID is None else LLM_SLOT_ID + worker_index
+
+    if not conversation["owner"]:
+        print(f"PROSESSERER ({conversation['name']}): {instruction}")
+        sms_sender.forget(conversation["number"])
+        process_llm_task(instruction, slot_id=slot_id, conversation=conversation)
+        return
+
+    print(f"PROSESSERER: {instruction}")
+    sms_sender.forget(MY_NUMBER)
+
+    # Hurtigkommandoer og svarcachen kan gi ut posisjon og annen eierinformasjon, så bare eieren bruker dem
+    if FAST_PATH_ENABLED:
+        reply = route_command(instruction, fast_path_routes, execute_tool)
+        if reply is not None:
+            print(f"Henry svarer (hurtigkommando): {reply}")
+            append_history("user", instruction)
+            append_history("assistant", reply)
+            send_reply(reply)
+            return
+
+    if RESPONSE_CACHE_ENABLED:
+        reply = response_cache.lookup(instruction, execute_tool)
+        if reply is not None:
+            print(f"Henry svarer (fra cache): {reply}")
+            append_history("user", instruction)
+            append_history("assistant", reply)
+            send_reply(reply)
+            return
+
+    process_llm_task(instruction, slot_id=slot_id, conversation=conversation)
+
+
+response_cache = ResponseCache(
+    load=lambda: get_storage().get("response_cache"),
+    save=lambda data: get_storage().put("response_cache", data),
+    live_tools=set(TOOL_CACHE_POLICIES) | {"get_clipboard"},
+    state_tools={"list_tasks": "tasks"},
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL
+)
+
+fast_path_routes = compile_routes(load_json(ROUTES_FILE, []) + DEFAULT_ROUTES)
+
+
+sms_poller = AdaptivePoller(
+    fast_interval=SMS_POLL_FAST_INTERVAL,
+    max_interval=SMS_POLL_MAX_INTERVAL,
+    active_window=SMS_POLL_ACTIVE_WINDOW
+)
+
+sms_sender = SmsSender(
+    send=send_sms_part,
+    load_pending=lambda: get_storage().get("sms_outbox", []),
+    save_pending=lambda pending: get_storage().put("sms_outbox", pending),
+    rate=SMS_SEND_RATE,
+    period=SMS_SEND_PERIOD,
+    min_interval=SMS_SEND_MIN_INTERVAL,
+    retries=SMS_SEND_RETRIES,
+    backoff=SMS_SEND_BACKOFF,
+    dedupe_window=SMS_DEDUPE_WINDOW
+)
+
+conversations = ConversationRegistry(
+    owner_number=lambda: MY_NUMBER,
+    load_contacts=lambda: load_memory().get("contacts", [])
+)
+
+
+def queue_key(message):
+    if "conversation" in message:
+        return message["conversation"]
+    # Meldinger lagret før samtaler fantes mangler nøkkelen
+    conversation = conversations.lookup(message.get("number", ""))
+    return conversation["key"] if conversation else None
+
+
+sms_queue = SmsQueue(
+    load_pending=lambda: get_storage().get("sms_queue", []),
+    save_pending=lambda pending: get_storage().put("sms_queue", pending),
+    handle=handle_sms,
+    workers=SMS_WORKERS,
+    key=queue_key,
+    # Eieren går foran kontaktene; ellers får samtalene tur etter tur
+    priority=lambda key: 0 if key is None else 1
+)
 
 
 def run_agent_loop():
     ensure_data_files()
-    state = load_json(STATE_FILE, DEFAULT_STATE)
+    if Image is None:
+        print("Pillow er ikke installert; bilder sendes med MMS uten komprimering")
+    state = get_storage().get("state", dict(DEFAULT_STATE))
     print("Henry våkner... Nullstiller innboks for å ignorere gamle meldinger.")
 
     try:
-        data = json.loads(call_termux("termux-sms-list -l 20"))
-        inbox_ids = [int(m["_id"]) for m in data if m.get("type") == "inbox"]
+        data = json.loads(call_termux(["termux-sms-list", "-t", "inbox", "-l", "1"]))
+        inbox_ids = [int(m["_id"]) for m in data if m.get("type", "inbox") == "inbox"]
         if inbox_ids:
             state["last_checked_sms_id"] = max(inbox_ids)
         else:
             state["last_checked_sms_id"] = 0
-        save_json(STATE_FILE, state)
+        get_storage().put("state", state)
         print(f"Synkronisert. Ignorerer alt med ID {state['last_checked_sms_id']} eller lavere.")
     except Exception as e:
         print(f"Kunne ikke synkronisere: {e}")
         state["last_checked_sms_id"] = 999999999
-        save_json(STATE_FILE, state)
+        get_storage().put("state", state)
 
-    while True:
-        run_scheduled_tasks()
-        instruction = check_for_sms_commands(state)
+    llm_pool.start()
+    metrics.start_exporter(METRICS_PROM_FILE, METRICS_JSONL_FILE, METRICS_EXPORT_INTERVAL)
+    scheduler.start()
+    sms_sender.start()
+    sms_queue.start()
+    # Samtaler med ny historikk som ikke er vurdert for oppsummering ennå; None er eierens
+    unsummarized = {None}
 
-        if instruction:
-            print(f"PROSESSERER: {instruction}")
-            process_llm_task(instruction)
+    while True:
+        new_messages = check_for_sms_commands(state)
+        sms_poller.record(bool(new_messages))
+        if new_messages:
+            unsummarized.update(message["conversation"] for message in new_messages)
+        elif unsummarized and sms_queue.is_idle():
+            # Oppsummering av eldre historikk gjøres mens Henry er ledig, ikke under en forespørsel.
+            # Én samtale oppsummeres om gangen; resten venter til neste ledige runde
+            for key in list(unsummarized):
+                if context_manager.summarizing():
+                    break
+                context_manager.summarize_in_background(pending_history_for_summary(key), key)
+                unsummarized.discard(key)
 
-        time.sleep(5)
+        sms_poller.wait()
 
 if __name__ == "__main__":
     run_agent_loop()
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ScriptedLLM:
+    def __init__(self, rules, default_reply="OK", prompt_delay_per_1k_chars=0.0, token_delay=0.0, n_ctx=8192):
+        self.rules = rules
+        self.default_reply = default_reply
+        self.prompt_delay_per_1k_chars = prompt_delay_per_1k_chars
+        self.token_delay = token_delay
+        self.n_ctx = n_ctx
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def respond(self, body):
+        messages = body.get("messages", [])
+        last_user = max((index for index, message in enumerate(messages) if message.get("role") == "user"), default=-1)
+        instruction = messages[last_user]["content"] if last_user >= 0 else ""
+        step = sum(1 for message in messages[last_user + 1:] if message.get("role") == "assistant")
+        prompt_chars = sum(len(json.dumps(message, ensure_ascii=False)) for message in messages)
+        prompt_chars += len(json.dumps(body.get("tools") or [], ensure_ascii=False))
+
+        with self.lock:
+            self.requests.append({
+                "instruction": instruction,
+                "step": step,
+                "tools": [tool["function"]["name"] for tool in body.get("tools") or []],
+                "prompt_chars": prompt_chars,
+                "time": time.time()
+            })
+
+        if not body.get("tools"):
+            return {"content": "Sammendrag av samtalen."}, prompt_chars
+        for rule in self.rules:
+            if rule["match"].lower() in instruction.lower():
+                steps = rule["steps"]
+                return steps[min(step, len(steps) - 1)], prompt_chars
+        return {"content": self.default_reply}, prompt_chars
+
+
+def make_handler(llm):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json({"status": "ok"})
+            elif self.path == "/props":
+                self._send_json({"default_generation_settings": {"n_ctx": llm.n_ctx}, "total_slots": 1})
+            elif self.path == "/v1/models":
+                self._send_json({"data": [{"id": "fake"}]})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/tokenize":
+                # Omtrent som en ekte tokenizer: ett token per fire tegn
+                self._send_json({"tokens": list(range(max(1, len(body.get("content", "")) // 4)))})
+                return
+
+            step, prompt_chars = llm.respond(body)
+            time.sleep(prompt_chars / 1000 * llm.prompt_delay_per_1k_chars)
+            message = {"role": "assistant", "content": step.get("content")}
+            if step.get("tool_calls"):
+                message["tool_calls"] = [
+                    {
+                        "id": f"call_{index}",
+                        "type": "function",
+                        "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}
+                    }
+                    for index, call in enumerate(step["tool_calls"])
+                ]
+            completion_tokens = max(1, len(json.dumps(message)) // 4)
+            time.sleep(completion_tokens * llm.token_delay)
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_tokens}
+            finish_reason = "tool_calls" if step.get("tool_calls") else "stop"
+
+            if not body.get("stream"):
+                self._send_json({
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage
+                })
+                return
+
+            delta = {"role": "assistant"}
+            if message.get("content"):
+                delta["content"] = message["content"]
+            if message.get("tool_calls"):
+                delta["tool_calls"] = [dict(call, index=index) for index, call in enumerate(message["tool_calls"])]
+            chunks = [
+                {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]},
+                {"choices": [], "usage": usage, "timings": {"prompt_n": usage["prompt_tokens"], "cache_n": 0}}
+            ]
+            data = b"".join(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n" for chunk in chunks)
+            data += b"data: [DONE]\n\n"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_server(llm, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(llm))
+    thread = threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import time
+
+STATE_DIR = os.environ.get("HENRY_BENCH_STATE", ".")
+
+RESPONSES = {
+    "termux-battery-status": {"health": "GOOD", "percentage": 81, "plugged": "UNPLUGGED", "status": "DISCHARGING", "temperature": 30.2, "current": -250000},
+    "termux-wifi-connectioninfo": {"bssid": "02:00:00:00:00:00", "frequency_mhz": 5180, "ip": "192.168.1.23", "link_speed_mbps": 433, "rssi": -58, "ssid": "Hjemme", "supplicant_state": "COMPLETED"},
+    "termux-location": {"latitude": 59.9139, "longitude": 10.7522, "altitude": 23.0, "accuracy": 12.0, "provider": "gps"},
+    "termux-telephony-deviceinfo": {"network_operator_name": "Telenor", "network_type": "lte", "network_roaming": False, "phone_type": "gsm"},
+    "termux-clipboard-get": "kopiert tekst"
+}
+
+
+def load_config():
+    try:
+        with open(os.path.join(STATE_DIR, "termux_config.json"), "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return {}
+
+
+def record(name, args, started):
+    with open(os.path.join(STATE_DIR, "calls.jsonl"), "a", encoding="utf-8") as handle:
+        handle.write(json.dumps({"name": name, "args": args, "start": started, "end": time.time()}) + "\n")
+
+
+def option(args, flag, default=None):
+    if flag in args:
+        index = args.index(flag)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return default
+
+
+def sms_list(args):
+    try:
+        with open(os.path.join(STATE_DIR, "inbox.json"), "r", encoding="utf-8") as handle:
+            messages = json.load(handle)
+    except FileNotFoundError:
+        messages = []
+    kind = option(args, "-t", "all")
+    if kind != "all":
+        messages = [msg for msg in messages if msg.get("type") == kind]
+    offset = int(option(args, "-o", 0))
+    limit = int(option(args, "-l", 10))
+    newest_first = sorted(messages, key=lambda msg: msg["_id"], reverse=True)
+    page = newest_first[offset:offset + limit]
+    return json.dumps(sorted(page, key=lambda msg: msg["_id"]), ensure_ascii=False)
+
+
+def sms_send(args):
+    rest = list(args)
+    number = option(rest, "-n")
+    attachment = option(rest, "-a")
+    for flag in ("-n", "-a", "-s"):
+        if flag in rest:
+            index = rest.index(flag)
+            del rest[index:index + 2]
+    with open(os.path.join(STATE_DIR, "sent.jsonl"), "a", encoding="utf-8") as handle:
+        handle.write(json.dumps({
+            "number": number,
+            "attachment": attachment,
+            "message": " ".join(rest),
+            "time": time.time()
+        }, ensure_ascii=False) + "\n")
+    return ""
+
+
+def main():
+    name = os.path.basename(sys.argv[0])
+    args = sys.argv[1:]
+    started = time.time()
+    config = load_config()
+    delays = config.get("delays", {})
+    time.sleep(delays.get(name, delays.get("default", 0.0)))
+
+    if name == "termux-sms-list":
+        output = sms_list(args)
+    elif name == "termux-sms-send":
+        output = sms_send(args)
+    elif name == "termux-camera-photo":
+        target = args[-1]
+        if not os.path.isdir(os.path.dirname(target) or "."):
+            target = os.path.join(STATE_DIR, os.path.basename(target))
+        with open(target, "wb") as handle:
+            handle.write(b"\xff\xd8\xff\xd9")
+        output = ""
+    elif name in RESPONSES:
+        response = RESPONSES[name]
+        output = response if isinstance(response, str) else json.dumps(response)
+    else:
+        output = ""
+
+    record(name, args, started)
+    if output:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_llm_server import ScriptedLLM, start_server  # noqa: E402
+
+OWNER_NUMBER = "+4712345678"
+TERMUX_COMMANDS = [
+    "termux-sms-list",
+    "termux-sms-send",
+    "termux-battery-status",
+    "termux-wifi-connectioninfo",
+    "termux-location",
+    "termux-telephony-deviceinfo",
+    "termux-clipboard-get",
+    "termux-clipboard-set",
+    "termux-camera-photo"
+]
+# Nøkkeltall som sammenlignes mot en tidligere kjøring; høyere er verre for alle
+REGRESSION_KEYS = [
+    ("latency", "p50"),
+    ("latency", "p95"),
+    ("llm", "steps_per_message"),
+    ("subprocesses", "total"),
+    ("storage_io", "write_bytes")
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def read_jsonl(path):
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return [json.loads(line) for line in handle if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def write_json(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class FakeInbox:
+    def __init__(self, state_dir):
+        self.path = os.path.join(state_dir, "inbox.json")
+        self.messages = []
+        write_json(self.path, self.messages)
+
+    def receive(self, body, number=OWNER_NUMBER):
+        message = {
+            "threadid": 1,
+            "type": "inbox",
+            "read": False,
+            "number": number,
+            "received": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "body": body,
+            "_id": len(self.messages) + 1
+        }
+        self.messages.append(message)
+        write_json(self.path, self.messages)
+        return time.time()
+
+
+def setup_environment(workdir, trace):
+    bin_dir = os.path.join(workdir, "bin")
+    state_dir = os.path.join(workdir, "termux")
+    data_dir = os.path.join(workdir, "data")
+    for directory in (bin_dir, state_dir, data_dir):
+        os.makedirs(directory, exist_ok=True)
+    for command in TERMUX_COMMANDS:
+        os.symlink(os.path.join(BENCH_DIR, "fake_termux.py"), os.path.join(bin_dir, command))
+    write_json(os.path.join(state_dir, "termux_config.json"), {"delays": trace.get("termux_delays", {})})
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["HENRY_BENCH_STATE"] = state_dir
+    return state_dir, data_dir
+
+
+def configure_agent(agent, data_dir, server_url):
+    from llm_pool import Backend
+
+    agent.MY_NUMBER = OWNER_NUMBER
+    agent.DATA_DIR = data_dir
+    agent.STATE_FILE = os.path.join(data_dir, "state.json")
+    agent.HISTORY_FILE = os.path.join(data_dir, "history.json")
+    agent.TASKS_FILE = os.path.join(data_dir, "tasks.json")
+    agent.MEMORY_FILE = os.path.join(data_dir, "user_profile.json")
+    agent.METRICS_PROM_FILE = os.path.join(data_dir, "metrics.prom")
+    agent.METRICS_JSONL_FILE = os.path.join(data_dir, "metrics.jsonl")
+    agent._storage = None
+    agent.llm_pool.backends = [
+        Backend("fake", server_url, "fake", connect_timeout=2, first_token_timeout=60, max_generation_time=120)
+    ]
+
+
+def instrument_storage(storage):
+    counters = {"reads": 0, "writes": 0, "read_bytes": 0, "write_bytes": 0}
+
+    def size(value):
+        return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def wrap_read(method):
+        def wrapper(*args, **kwargs):
+            value = method(*args, **kwargs)
+            counters["reads"] += 1
+            counters["read_bytes"] += size(value)
+            return value
+        return wrapper
+
+    def wrap_write(method):
+        def wrapper(key, value, *args, **kwargs):
+            counters["writes"] += 1
+            counters["write_bytes"] += size(value)
+            return method(key, value, *args, **kwargs)
+        return wrapper
+
+    storage.get = wrap_read(storage.get)
+    storage.items = wrap_read(storage.items)
+    storage.put = wrap_write(storage.put)
+    storage.append = wrap_write(storage.append)
+    storage.extend = wrap_write(storage.extend)
+    return counters
+
+
+def process_write_bytes():
+    try:
+        with open("/proc/self/io", "r") as handle:
+            for line in handle:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def match_replies(received, sent):
+    # Hvert svar til eieren knyttes til den eldste ubesvarte meldingen mottatt før svaret
+    latencies = []
+    pending = list(received)
+    for reply in sorted(sent, key=lambda item: item["time"]):
+        candidates = [item for item in pending if item["time"] <= reply["time"]]
+        if not candidates:
+            continue
+        oldest = candidates[0]
+        pending.remove(oldest)
+        latencies.append(reply["time"] - oldest["time"])
+    return latencies
+
+
+def build_report(trace, received, state_dir, llm, storage_io, write_bytes, scheduler_lags, elapsed):
+    sent = read_jsonl(os.path.join(state_dir, "sent.jsonl"))
+    replies = [item for item in sent if item["number"] == OWNER_NUMBER]
+    latencies = match_replies(received, replies)
+    calls = read_jsonl(os.path.join(state_dir, "calls.jsonl"))
+    by_command = {}
+    for call in calls:
+        by_command[call["name"]] = by_command.get(call["name"], 0) + 1
+    tool_requests = [request for request in llm.requests if request["tools"]]
+
+    return {
+        "trace": trace.get("name"),
+        "elapsed": round(elapsed, 3),
+        "messages": len(received),
+        "replies": len(replies),
+        "latency": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None
+        },
+        "llm": {
+            "requests": len(llm.requests),
+            "tool_requests": len(tool_requests),
+            "steps_per_message": len(tool_requests) / len(received) if received else 0,
+            "mean_prompt_chars": (
+                sum(request["prompt_chars"] for request in tool_requests) / len(tool_requests)
+                if tool_requests else 0
+            )
+        },
+        "subprocesses": {"total": len(calls), "by_command": by_command},
+        "storage_io": storage_io,
+        "process_write_bytes": write_bytes,
+        "scheduler": {
+            "runs": len(scheduler_lags),
+            "lag_p50": percentile(scheduler_lags, 0.5),
+            "lag_p95": percentile(scheduler_lags, 0.95)
+        },
+        "outgoing_sms": len(sent)
+    }
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for section, key in REGRESSION_KEYS:
+        current = (report.get(section) or {}).get(key)
+        previous = (baseline.get(section) or {}).get(key)
+        if current is None or previous is None:
+            continue
+        if current > previous * (1 + tolerance) + 1e-3:
+            regressions.append(f"{section}.{key}: {previous} -> {current}")
+    return regressions
+
+
+def run(trace, timeout):
+    workdir = tempfile.mkdtemp(prefix="henry-bench-")
+    state_dir, data_dir = setup_environment(workdir, trace)
+    llm = ScriptedLLM(trace.get("llm_rules", []), **trace.get("llm", {}))
+    server = start_server(llm)
+    server_url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    import android_agent as agent
+    from scheduler import parse_time
+
+    configure_agent(agent, data_dir, server_url)
+    # Tell faktisk lagrings-I/O under minnecachen, ikke hvert oppslag i den
+    storage_io = instrument_storage(agent.get_storage().storage)
+
+    scheduler_lags = []
+    run_task = agent.scheduler.run_task
+
+    def timed_run_task(task, *args):
+        scheduler_lags.append((datetime.utcnow() - parse_time(task["next_run"])).total_seconds())
+        run_task(task, *args)
+
+    agent.scheduler.run_task = timed_run_task
+
+    inbox = FakeInbox(state_dir)
+    log_path = os.path.join(workdir, "agent.log")
+    real_stdout = sys.stdout
+    sys.stdout = open(log_path, "w", encoding="utf-8", buffering=1)
+    try:
+        threading.Thread(target=agent.run_agent_loop, name="agent", daemon=True).start()
+        while agent.scheduler.thread is None:
+            time.sleep(0.05)
+
+        write_bytes_start = process_write_bytes()
+        started = time.time()
+        for task in trace.get("tasks", []):
+            args = dict(task, schedule_type="once")
+            args["run_at"] = (datetime.utcnow() + timedelta(seconds=task.get("after", 0))).isoformat()
+            args.pop("after", None)
+            agent.schedule_task(args)
+
+        received = []
+        for sms in trace.get("sms", []):
+            delay = started + sms.get("at", 0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            received.append({"body": sms["body"], "time": inbox.receive(sms["body"])})
+
+        expected_replies = len(received)
+        expected_task_runs = len(trace.get("tasks", []))
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            sent = read_jsonl(os.path.join(state_dir, "sent.jsonl"))
+            replies = [item for item in sent if item["number"] == OWNER_NUMBER]
+            if len(replies) >= expected_replies and len(scheduler_lags) >= expected_task_runs:
+                break
+            time.sleep(0.1)
+        elapsed = time.time() - started
+        write_bytes_end = process_write_bytes()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        server.shutdown()
+
+    write_bytes = None
+    if write_bytes_start is not None and write_bytes_end is not None:
+        write_bytes = write_bytes_end - write_bytes_start
+    report = build_report(trace, received, state_dir, llm, storage_io, write_bytes, scheduler_lags, elapsed)
+    report["workdir"] = workdir
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spiller av SMS-spor mot Henry med falske Termux-verktøy og LLM")
+    parser.add_argument("trace", help="JSON-fil med sms, tasks, llm_rules, llm og termux_delays")
+    parser.add_argument("--output", help="skriv rapporten til denne filen")
+    parser.add_argument("--baseline", help="tidligere rapport å sammenligne mot")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="tillatt relativ forverring (0.25 = 25 %%)")
+    parser.add_argument("--timeout", type=float, default=120, help="sekunder å vente på svar")
+    args = parser.parse_args()
+
+    with open(args.trace, "r", encoding="utf-8") as handle:
+        trace = json.load(handle)
+
+    report = run(trace, args.timeout)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(output + "\n")
+
+    if report["replies"] < report["messages"]:
+        print(f"Bare {report['replies']} av {report['messages']} meldinger fikk svar", file=sys.stderr)
+        sys.exit(2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("Regresjoner:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
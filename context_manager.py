@@ -0,0 +1,163 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from retrieval import estimate_tokens
+
+ELIDED_MARKER = "[utelatt for å spare kontekst]"
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    def __init__(self, tokenize=None, cache_size=1024, retry_after=300):
+        self.tokenize = tokenize
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.retry_after = retry_after
+        self.remote_failed_at = None
+        self.lock = threading.Lock()
+
+    def count(self, text):
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        tokens = None
+        remote_available = self.remote_failed_at is None or time.monotonic() - self.remote_failed_at > self.retry_after
+        if self.tokenize and remote_available:
+            try:
+                tokens = self.tokenize(text)
+                self.remote_failed_at = None
+            except Exception:
+                # Serveren svarer ikke på /tokenize, bruk lokalt anslag en stund
+                self.remote_failed_at = time.monotonic()
+        if tokens is None:
+            tokens = estimate_tokens(text)
+
+        with self.lock:
+            self.cache[key] = tokens
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message):
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.count(message.get("content") or "")
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            tokens += self.count(function.get("name", "") + (function.get("arguments") or ""))
+        return tokens
+
+
+class ContextManager:
+    def __init__(self, counter, budget, tool_result_tokens, summarize, load_summary, save_summary,
+                 min_summary_entries=6):
+        self.counter = counter
+        self.budget = budget
+        self.tool_result_tokens = tool_result_tokens
+        self.summarize = summarize
+        self.load_summary = load_summary
+        self.save_summary = save_summary
+        self.min_summary_entries = min_summary_entries
+        self.summary_thread = None
+
+    def clip_tool_result(self, text):
+        text = str(text)
+        limit = self.tool_result_tokens
+        tokens = self.counter.count(text)
+        if tokens <= limit:
+            return text
+        # Behold starten og slutten av resultatet, og kutt midten proporsjonalt
+        keep_chars = int(len(text) * limit / tokens)
+        head = text[:keep_chars * 2 // 3]
+        tail = text[len(text) - keep_chars // 3:] if keep_chars // 3 else ""
+        omitted = len(text) - len(head) - len(tail)
+        return f"{head}\n[... {omitted} tegn utelatt ...]\n{tail}"
+
+    def fit(self, messages, turn_start, reserved=0):
+        budget = self.budget - reserved
+        counts = [self.counter.count_message(message) for message in messages]
+        total = sum(counts)
+        if total <= budget:
+            return messages, turn_start
+
+        # 1) Fjern innholdet i eldre verktøyresultater, men behold de fra siste steg
+        last_assistant = max(
+            (index for index, message in enumerate(messages) if message.get("role") == "assistant"),
+            default=len(messages)
+        )
+        for index in range(turn_start, last_assistant):
+            if total <= budget:
+                break
+            message = messages[index]
+            if message.get("role") != "tool" or message.get("content") == ELIDED_MARKER:
+                continue
+            messages[index] = dict(message, content=ELIDED_MARKER)
+            new_count = self.counter.count_message(messages[index])
+            total -= counts[index] - new_count
+            counts[index] = new_count
+
+        # 2) Dropp de eldste historikkmeldingene
+        history_start = next(
+            (index for index, message in enumerate(messages) if message.get("role") != "system"),
+            turn_start
+        )
+        dropped = set()
+        for index in range(history_start, turn_start):
+            if total <= budget:
+                break
+            if messages[index].get("role") == "system":
+                continue
+            dropped.add(index)
+            total -= counts[index]
+        if dropped:
+            messages = [message for index, message in enumerate(messages) if index not in dropped]
+            turn_start -= len(dropped)
+        return messages, turn_start
+
+    # key skiller sammendragene for ulike samtaler; None er eierens
+    def summary_text(self, key=None):
+        summary = self.load_summary(key) or {}
+        return summary.get("summary")
+
+    def summarized_until(self, key=None):
+        summary = self.load_summary(key) or {}
+        return summary.get("until_seq", -1)
+
+    def summarizing(self):
+        return self.summary_thread is not None and self.summary_thread.is_alive()
+
+    def summarize_in_background(self, pending_entries, key=None):
+        if len(pending_entries) < self.min_summary_entries:
+            return False
+        if self.summarizing():
+            return False
+        self.summary_thread = threading.Thread(
+            target=self._summarize, args=(pending_entries, key), name="history-summary", daemon=True
+        )
+        self.summary_thread.start()
+        return True
+
+    def _summarize(self, entries, key=None):
+        previous = self.summary_text(key) or ""
+        transcript = "\n".join(f"{entry['role']}: {entry['content']}" for entry in entries)
+        try:
+            text = self.summarize(previous, transcript)
+        except Exception as e:
+            print(f"Kunne ikke oppsummere historikk: {e}")
+            return
+        if text:
+            self.save_summary(key, {
+                "summary": text.strip(),
+                "until_seq": entries[-1].get("seq", -1),
+                "updated": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+            })
+
+
+def tools_token_count(counter, tools):
+    return counter.count(json.dumps(tools, ensure_ascii=False))
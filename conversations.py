@@ -0,0 +1,45 @@
+import re
+import threading
+
+
+def normalize_number(number, digits=8):
+    # Bare de siste sifrene sammenlignes, så "+47 400 00 000" og "40000000" blir samme samtale
+    return re.sub(r"\D", "", number or "")[-digits:]
+
+
+class ConversationRegistry:
+    def __init__(self, owner_number, load_contacts):
+        self.owner_number = owner_number
+        self.load_contacts = load_contacts
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, number):
+        key = normalize_number(number)
+        if not key:
+            return None
+        owner_number = self.owner_number()
+        if key == normalize_number(owner_number):
+            conversation = {
+                "key": None, "number": owner_number, "name": "eier",
+                "relationship": "Eier", "owner": True, "tools": None
+            }
+        else:
+            # Bare kontakter fra profilen får svar; listen leses hver gang, så nye kontakter virker straks
+            contact = next(
+                (item for item in self.load_contacts() or [] if normalize_number(item.get("number")) == key),
+                None
+            )
+            if contact is None:
+                return None
+            conversation = {
+                "key": key, "number": number, "name": contact.get("name") or number,
+                "relationship": contact.get("relationship"), "owner": False, "tools": contact.get("tools") or []
+            }
+        with self.lock:
+            self.seen[key] = conversation
+        return conversation
+
+    def conversations(self):
+        with self.lock:
+            return list(self.seen.values())
@@ -0,0 +1,88 @@
+import os
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class CommandFailed(Exception):
+    def __init__(self, argv, returncode, stderr):
+        self.returncode = returncode
+        self.stderr = stderr
+        detail = f": {stderr}" if stderr else ""
+        super().__init__(f"{argv[0]} feilet med kode {returncode}{detail}")
+
+
+class CommandExecutor:
+    def __init__(self, max_workers=4, default_timeout=30, timeouts=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="termux")
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        self.lock = threading.Lock()
+
+    def timeout_for(self, argv):
+        return self.timeouts.get(os.path.basename(argv[0]), self.default_timeout)
+
+    def submit(self, argv, timeout=None):
+        argv = [str(arg) for arg in argv]
+        if timeout is None:
+            timeout = self.timeout_for(argv)
+        handle = {"process": None, "cancelled": False}
+        future = self.pool.submit(self._run, argv, timeout, handle)
+        future.handle = handle
+        return future
+
+    def run(self, argv, timeout=None):
+        return self.submit(argv, timeout).result()
+
+    def cancel(self, future):
+        if future.cancel():
+            return True
+        handle = future.handle
+        with self.lock:
+            handle["cancelled"] = True
+            process = handle["process"]
+        if process is not None:
+            self._kill(process)
+        return True
+
+    def _run(self, argv, timeout, handle):
+        # Uten shell: argumentene sendes som de er, så anførselstegn i meldinger kan ikke ødelegge kommandoen
+        process = subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            start_new_session=True
+        )
+        with self.lock:
+            handle["process"] = process
+            cancelled = handle["cancelled"]
+        if cancelled:
+            self._kill(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(process)
+            process.communicate()
+            raise CommandTimeout(f"{argv[0]} svarte ikke innen {timeout} s")
+        if handle["cancelled"]:
+            raise CommandTimeout(f"{argv[0]} ble avbrutt")
+        if process.returncode != 0:
+            raise CommandFailed(argv, process.returncode, stderr.strip()[:500])
+        return stdout.strip()
+
+    @staticmethod
+    def _kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
+
+    def shutdown(self, wait=False):
+        self.pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,210 @@
+import fnmatch
+import mmap
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+SORT_KEYS = {
+    "name": lambda entry: entry["name"].lower(),
+    "size": lambda entry: entry["size"],
+    "mtime": lambda entry: entry["mtime"]
+}
+
+
+def _line_start(mapped, position):
+    return mapped.rfind(b"\n", 0, position) + 1
+
+
+def _line_end(mapped, position):
+    end = mapped.find(b"\n", position)
+    return len(mapped) if end == -1 else end
+
+
+def _count_lines(mapped, end, chunk_size=1 << 20):
+    # mmap har ingen count, så vi teller linjeskift bit for bit uten å lese alt inn på en gang
+    count = 0
+    for start in range(0, end, chunk_size):
+        count += mapped[start:min(end, start + chunk_size)].count(b"\n")
+    return count
+
+
+def _decode(line):
+    return line.decode("utf-8", errors="replace").rstrip("\r")
+
+
+def _read_lines(mapped, offset, length):
+    # Negativ offset teller fra slutten, som tail; nyttig for logger
+    if offset < 0:
+        end = len(mapped)
+        if mapped[end - 1:end] == b"\n":
+            end -= 1
+        start = end
+        for _ in range(-offset):
+            newline = mapped.rfind(b"\n", 0, end)
+            start = newline + 1
+            if newline == -1:
+                break
+            end = newline
+        offset = _count_lines(mapped, start)
+    else:
+        start = 0
+        for _ in range(offset):
+            newline = mapped.find(b"\n", start)
+            if newline == -1:
+                return offset, [], False
+            start = newline + 1
+
+    lines = []
+    position = start
+    while len(lines) < length and position < len(mapped):
+        end = _line_end(mapped, position)
+        lines.append((offset + len(lines), _decode(mapped[position:end])))
+        position = end + 1
+    return offset, lines, position < len(mapped)
+
+
+def _grep_lines(mapped, pattern, offset, length):
+    lines = []
+    skipped = 0
+    last_line_start = -1
+    line_number = 0
+    counted_until = 0
+    for match in pattern.finditer(mapped):
+        start = _line_start(mapped, match.start())
+        if start == last_line_start:
+            continue
+        last_line_start = start
+        if skipped < offset:
+            skipped += 1
+            continue
+        if len(lines) >= length:
+            return lines, True
+        # Linjenummeret telles bare fram til hvert treff, ikke for hele filen
+        while True:
+            newline = mapped.find(b"\n", counted_until, start)
+            if newline == -1:
+                break
+            line_number += 1
+            counted_until = newline + 1
+        lines.append((line_number, _decode(mapped[start:_line_end(mapped, start)])))
+    return lines, False
+
+
+def read_file(path, offset=0, length=100, pattern=None, max_chars=4000):
+    path = os.path.expanduser(path)
+    try:
+        size = os.path.getsize(path)
+    except OSError as e:
+        return f"Kunne ikke lese {path}: {e.strerror or e}"
+    if os.path.isdir(path):
+        return f"{path} er en mappe, bruk list_files"
+    if size == 0:
+        return f"{path} er tom"
+
+    try:
+        regex = re.compile(pattern.encode("utf-8"), re.IGNORECASE) if pattern else None
+    except re.error as e:
+        return f"Ugyldig mønster: {e}"
+
+    # mmap lar oss hoppe til en linje eller søke i store filer uten å lese hele filen inn i minnet
+    with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if regex is not None:
+            offset = max(0, offset)
+            lines, more = _grep_lines(mapped, regex, offset, length)
+            header = f"{path}: {len(lines)} treff på «{pattern}»"
+        else:
+            offset, lines, more = _read_lines(mapped, offset, length)
+            header = f"{path}: linje {offset + 1}-{offset + len(lines)}" if lines else f"{path}: ingen linjer fra {offset + 1}"
+
+    output = []
+    used = len(header)
+    for number, text in lines:
+        line = f"{number + 1}: {text}"
+        if used + len(line) + 1 > max_chars and output:
+            more = True
+            break
+        output.append(line[:max_chars])
+        used += len(line) + 1
+    if more:
+        output.append(f"(mer: offset={offset + len(output)})")
+    return "\n".join([header] + output)
+
+
+class DirectoryCache:
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def scan(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.entries.get(path)
+            # Mappens mtime endres når filer legges til eller fjernes, så da leses den på nytt
+            if cached is not None and cached[1] == mtime and time.monotonic() - cached[0] < self.ttl:
+                return cached[2]
+        entries = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    info = entry.stat()
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                entries.append({
+                    "name": entry.name,
+                    "is_dir": is_dir,
+                    "size": 0 if is_dir else info.st_size,
+                    "mtime": info.st_mtime
+                })
+        with self.lock:
+            self.entries[path] = (time.monotonic(), mtime, entries)
+        return entries
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(path, None)
+
+
+def format_size(size):
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def list_files(cache, path, offset=0, limit=50, sort="name", pattern=None, descending=False):
+    path = os.path.expanduser(path)
+    try:
+        entries = cache.scan(path)
+    except OSError as e:
+        return f"Kunne ikke liste {path}: {e.strerror or e}"
+
+    if pattern:
+        entries = [entry for entry in entries if fnmatch.fnmatch(entry["name"].lower(), pattern.lower())]
+    key = SORT_KEYS.get(sort, SORT_KEYS["name"])
+    # Mapper først ved sortering på navn, ellers ren sortering på valgt felt
+    if sort == "name":
+        entries = sorted(entries, key=lambda entry: (not entry["is_dir"], key(entry)), reverse=descending)
+    else:
+        entries = sorted(entries, key=key, reverse=descending)
+
+    offset = max(0, offset)
+    page = entries[offset:offset + limit]
+    if not page:
+        return f"{path}: ingen filer" + (f" som passer «{pattern}»" if pattern else "")
+    lines = [f"{path}: {offset + 1}-{offset + len(page)} av {len(entries)}"]
+    for entry in page:
+        modified = datetime.fromtimestamp(entry["mtime"]).strftime("%Y-%m-%d %H:%M")
+        if entry["is_dir"]:
+            lines.append(f"{entry['name']}/  {modified}")
+        else:
+            lines.append(f"{entry['name']}  {format_size(entry['size'])}  {modified}")
+    if offset + len(page) < len(entries):
+        lines.append(f"(mer: offset={offset + len(page)})")
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+import json
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LLMError(Exception):
+    pass
+
+
+class ChatClient:
+    def __init__(self, url, model, connect_timeout=5, first_token_timeout=180,
+                 max_generation_time=600, pool_size=4, stream=True):
+        self.url = url
+        self.base_url = url.split("/v1/")[0].rstrip("/")
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.max_generation_time = max_generation_time
+        self.stream = stream
+
+        # Én Session per klient gir keep-alive og gjenbruk av TCP-forbindelser mellom stegene
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def complete(self, messages, tools=None, tool_choice="auto", **extra):
+        payload = {"model": self.model, "messages": messages}
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = tool_choice
+        payload.update(extra)
+
+        if not self.stream:
+            response = self.session.post(
+                self.url,
+                json=payload,
+                timeout=(self.connect_timeout, self.first_token_timeout + self.max_generation_time)
+            )
+            response.raise_for_status()
+            return response.json()
+
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        # Lesetimeouten gjelder tiden mellom mottatte bytes, så den dekker prompt-prosessering
+        # frem til første token uten å drepe en treg men fremadskridende generering
+        with self.session.post(
+            self.url,
+            json=payload,
+            stream=True,
+            timeout=(self.connect_timeout, self.first_token_timeout)
+        ) as response:
+            response.raise_for_status()
+            return self._read_stream(response)
+
+    def _read_stream(self, response):
+        started = time.monotonic()
+        first_token_at = None
+        content_parts = []
+        tool_calls = {}
+        finish_reason = None
+        usage = None
+        timings = None
+
+        for raw_line in response.iter_lines():
+            if not raw_line:
+                continue
+            line = raw_line.decode("utf-8", errors="replace")
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+
+            if "error" in chunk:
+                raise LLMError(str(chunk["error"]))
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            if chunk.get("timings"):
+                timings = chunk["timings"]
+
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if first_token_at is None and (delta.get("content") or delta.get("tool_calls")):
+                    first_token_at = time.monotonic()
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                for call_delta in delta.get("tool_calls") or []:
+                    self._merge_tool_call(tool_calls, call_delta)
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+
+            if time.monotonic() - started > self.first_token_timeout + self.max_generation_time:
+                raise LLMError("Generering tok for lang tid")
+
+        message = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+
+        result = {
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage,
+            "latency": {
+                "first_token": None if first_token_at is None else first_token_at - started,
+                "total": time.monotonic() - started
+            }
+        }
+        if timings:
+            result["timings"] = timings
+        return result
+
+    def tokenize(self, text):
+        response = self.session.post(
+            f"{self.base_url}/tokenize",
+            json={"content": text},
+            timeout=(self.connect_timeout, 10)
+        )
+        response.raise_for_status()
+        return len(response.json().get("tokens", []))
+
+    @staticmethod
+    def _merge_tool_call(tool_calls, call_delta):
+        index = call_delta.get("index", len(tool_calls))
+        call = tool_calls.setdefault(index, {
+            "id": None,
+            "type": "function",
+            "function": {"name": "", "arguments": ""}
+        })
+        if call_delta.get("id"):
+            call["id"] = call_delta["id"]
+        function = call_delta.get("function") or {}
+        if function.get("name"):
+            call["function"]["name"] += function["name"]
+        if function.get("arguments"):
+            call["function"]["arguments"] += function["arguments"]
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,150 @@
+import threading
+import time
+
+from llm_client import ChatClient, LLMError
+
+
+class Backend:
+    def __init__(self, name, url, model, roles=None, slots=1, max_context=None, **client_options):
+        self.name = name
+        self.roles = set(roles) if roles else None
+        self.slots = slots
+        self.max_context = max_context
+        self.client = ChatClient(url, model, **client_options)
+        self.healthy = True
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    def supports(self, role):
+        return self.roles is None or role in self.roles
+
+    def fits(self, context_tokens):
+        return not context_tokens or not self.max_context or context_tokens < self.max_context
+
+    def score(self):
+        # Forventet ventetid: observert latens skalert med hvor mange forespørsler som allerede venter
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + self.in_flight / max(1, self.slots))
+
+    def record_success(self, latency, alpha=0.3):
+        with self.lock:
+            self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+            self.healthy = True
+            self.failures = 0
+
+    def record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.healthy = False
+
+    def check_health(self):
+        session = self.client.session
+        timeout = (self.client.connect_timeout, 5)
+        try:
+            response = session.get(f"{self.client.base_url}/health", timeout=timeout)
+            if response.status_code == 404:
+                response = session.get(f"{self.client.base_url}/v1/models", timeout=timeout)
+            healthy = response.status_code == 200
+        except Exception as e:
+            self.record_failure(e)
+            return False
+
+        if healthy and self.max_context is None:
+            # llama.cpp oppgir kontekststørrelse og antall slots via /props
+            try:
+                props = session.get(f"{self.client.base_url}/props", timeout=timeout).json()
+                settings = props.get("default_generation_settings") or {}
+                self.max_context = settings.get("n_ctx") or props.get("n_ctx")
+                self.slots = props.get("total_slots") or self.slots
+            except Exception:
+                pass
+
+        with self.lock:
+            self.healthy = healthy
+            if healthy:
+                self.failures = 0
+        return healthy
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "latency": self.latency,
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "max_context": self.max_context,
+            "last_error": self.last_error
+        }
+
+
+class LLMPool:
+    def __init__(self, backends, health_interval=30):
+        self.backends = backends
+        self.health_interval = health_interval
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def rank(self, role="default", context_tokens=None):
+        candidates = [backend for backend in self.backends if backend.supports(role)] or list(self.backends)
+        fitting = [backend for backend in candidates if backend.fits(context_tokens)] or candidates
+        # Friske backends først etter forventet ventetid; syke prøves bare som siste utvei
+        return sorted(fitting, key=lambda backend: (not backend.healthy, backend.score()))
+
+    def complete(self, messages, tools=None, tool_choice="auto", role="default", context_tokens=None, **extra):
+        errors = []
+        for backend in self.rank(role, context_tokens):
+            options = dict(extra)
+            if options.get("id_slot") is not None and options["id_slot"] >= backend.slots:
+                options.pop("id_slot")
+            with backend.lock:
+                backend.in_flight += 1
+            started = time.monotonic()
+            try:
+                # Hele meldingslisten sendes hver gang, så en annen backend kan ta over midt i samtalen
+                response = backend.client.complete(messages, tools=tools, tool_choice=tool_choice, **options)
+            except Exception as e:
+                backend.record_failure(e)
+                errors.append(f"{backend.name}: {e}")
+                continue
+            finally:
+                with backend.lock:
+                    backend.in_flight -= 1
+            latency = (response.get("latency") or {}).get("first_token") or time.monotonic() - started
+            backend.record_success(latency)
+            response["backend"] = backend.name
+            return response
+        raise LLMError("Ingen LLM-backend svarte: " + "; ".join(errors))
+
+    def tokenize(self, text):
+        errors = []
+        for backend in self.rank():
+            try:
+                return backend.client.tokenize(text)
+            except Exception as e:
+                errors.append(str(e))
+        raise LLMError("Ingen backend kunne tokenisere: " + "; ".join(errors))
+
+    def check_health(self):
+        for backend in self.backends:
+            backend.check_health()
+
+    def _health_loop(self):
+        while not self.stopped.is_set():
+            self.check_health()
+            self.stopped.wait(self.health_interval)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def snapshot(self):
+        return [backend.snapshot() for backend in self.backends]
@@ -0,0 +1,101 @@
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow er valgfritt; uten det sendes bildene uendret
+    Image = None
+    ImageOps = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".bmp"}
+QUALITIES = (85, 75, 65, 55, 45)
+
+
+def variant_path(path):
+    stem, _ = os.path.splitext(path)
+    return f"{stem}.mms.jpg"
+
+
+def _write_bytes(path, data):
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _encode(image, max_bytes):
+    data = None
+    for quality in QUALITIES:
+        buffer = io.BytesIO()
+        # Uten exif-argumentet skrives ingen EXIF, så GPS-posisjon og kameradata følger ikke med
+        image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        data = buffer.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return data
+
+
+def optimize_image(path, max_bytes, max_side):
+    if Image is None or os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS:
+        return path
+    target = variant_path(path)
+    if target == path:
+        return path
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+
+    with Image.open(path) as original:
+        # Roter etter EXIF-orienteringen før den fjernes, ellers kan bildet havne på siden
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    image.thumbnail((max_side, max_side))
+    data = _encode(image, max_bytes)
+    while len(data) > max_bytes and min(image.size) > 160:
+        image = image.resize((int(image.width * 0.75), int(image.height * 0.75)))
+        data = _encode(image, max_bytes)
+    _write_bytes(target, data)
+    return target
+
+
+class MediaPipeline:
+    def __init__(self, max_bytes, max_side, workers=1):
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media")
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def prepare(self, path):
+        # Samme bilde kodes bare én gang selv om det bes om fra flere steder samtidig
+        with self.lock:
+            future = self.inflight.get(path)
+            if future is not None:
+                return future
+            future = self.executor.submit(self._optimize, path)
+            self.inflight[path] = future
+        future.add_done_callback(lambda _: self._done(path))
+        return future
+
+    def _done(self, path):
+        with self.lock:
+            self.inflight.pop(path, None)
+
+    def _optimize(self, path):
+        try:
+            return optimize_image(path, self.max_bytes, self.max_side)
+        except Exception as e:
+            print(f"Kunne ikke komprimere {path}: {e}")
+            return path
+
+    def send_when_ready(self, path, send):
+        # send kalles fra arbeidstråden når bildet er klart, så den som ber om sending venter ikke på kodingen
+        self.prepare(path).add_done_callback(lambda prepared: send(prepared.result()))
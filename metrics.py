@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from storage import save_text
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    def __init__(self, window=1024):
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.recent.append(value)
+        self.count += 1
+        self.total += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+    def quantile(self, q):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": max(self.recent) if self.recent else None
+        }
+
+
+class Metrics:
+    def __init__(self, window=1024):
+        self.window = window
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.exporter = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.window)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {
+                _format_key(name, labels): histogram.summary()
+                for (name, labels), histogram in self.histograms.items()
+            }
+            counters = {_format_key(name, labels): value for (name, labels), value in self.counters.items()}
+        return {"uptime": time.time() - self.started, "histograms": histograms, "counters": counters}
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"henry_{name}_seconds" if not name.endswith(("_tokens", "_per_second")) else f"henry_{name}"
+                for bound, count in zip(BUCKETS, histogram.buckets):
+                    lines.append(f"{metric}_bucket{_labels(labels, le=str(bound))} {count}")
+                lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels(labels)} {histogram.total}")
+                lines.append(f"{metric}_count{_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"henry_{name}_total{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, prom_path, jsonl_path, jsonl_max_bytes=5 * 1024 * 1024):
+        save_text(prom_path, self.prometheus_text())
+        if os.path.exists(jsonl_path) and os.path.getsize(jsonl_path) > jsonl_max_bytes:
+            os.replace(jsonl_path, f"{jsonl_path}.1")
+        record = dict(self.snapshot(), timestamp=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()))
+        with open(jsonl_path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def start_exporter(self, prom_path, jsonl_path, interval=60):
+        if self.exporter is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(prom_path, jsonl_path)
+                except Exception as e:
+                    print(f"Kunne ikke skrive metrikker: {e}")
+
+        self.exporter = threading.Thread(target=loop, name="metrics-export", daemon=True)
+        self.exporter.start()
+
+
+def _format_key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+
+
+def _escape(value):
+    # Prometheus krever at backslash, anførselstegn og linjeskift escapes i labelverdier
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+class TimedStorage:
+    def __init__(self, storage, metrics):
+        self.storage = storage
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _timed(self, operation, method, *args, **kwargs):
+        with self.metrics.timer("storage", op=operation):
+            return method(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._timed("load", self.storage.get, *args, **kwargs)
+
+    def items(self, *args, **kwargs):
+        return self._timed("load", self.storage.items, *args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        return self._timed("save", self.storage.put, *args, **kwargs)
+
+    def append(self, *args, **kwargs):
+        return self._timed("append", self.storage.append, *args, **kwargs)
+
+    def extend(self, *args, **kwargs):
+        return self._timed("append", self.storage.extend, *args, **kwargs)
+
+
+def format_stats(snapshot, names=None):
+    parts = [f"Oppetid {snapshot['uptime'] / 3600:.1f} t"]
+    for key, summary in sorted(snapshot["histograms"].items()):
+        if names and not key.startswith(tuple(names)):
+            continue
+        if summary["p50"] is None:
+            continue
+        parts.append(f"{key}: n={summary['count']} p50={summary['p50']:.2f} p95={summary['p95']:.2f}")
+    for key, value in sorted(snapshot["counters"].items()):
+        if names and not key.startswith(tuple(names)):
+            continue
+        parts.append(f"{key}: {value}")
+    return "\n".join(parts)
+
+
+metrics = Metrics()
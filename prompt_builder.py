@@ -0,0 +1,82 @@
+import json
+
+# Meldingene bygges slik at den lengste mulige prefiksen er byte-identisk mellom forespørsler:
+# fast systemprompt (og faste verktøyskjemaer) først, deretter minner som kun vokser ved
+# at notater legges til på slutten, og til slutt historikk og selve instruksjonen.
+
+
+def serialize_memory(memory):
+    core = {key: value for key, value in memory.items() if key != "notes"}
+    lines = ["MINNER: " + json.dumps(core, ensure_ascii=False, sort_keys=True, separators=(",", ":"))]
+    notes = memory.get("notes") or []
+    if notes:
+        lines.append("NOTATER:")
+        for note in notes:
+            lines.append(f"- [{str(note.get('timestamp', ''))[:16]}] {note.get('note', '')}")
+    return "\n".join(lines)
+
+
+def history_window(history, max_items, block):
+    if not history:
+        return []
+    # Starten på vinduet flyttes i hele blokker, så prefiksen holder seg stabil over flere
+    # forespørsler i stedet for å forskyves med én melding hver gang
+    total = history[-1].get("seq", len(history) - 1) + 1
+    overflow = max(0, total - max_items)
+    start = -(-overflow // block) * block
+    return [entry for index, entry in enumerate(history) if entry.get("seq", index) >= start]
+
+
+def number_history(history, offset=0):
+    # Meldinger fra før seq fantes ligger først i listen og nummereres etter plassen sin, regnet bakover
+    # fra første nummererte melding. offset er antall eldre meldinger som ikke er med i history
+    first = next((index for index, entry in enumerate(history) if "seq" in entry), None)
+    base = offset if first is None else history[first]["seq"] - first
+    return [entry if "seq" in entry else dict(entry, seq=base + index) for index, entry in enumerate(history)]
+
+
+def serialize_recalled(recalled):
+    lines = []
+    if recalled.get("contacts"):
+        lines.append("RELEVANTE KONTAKTER: " + json.dumps(recalled["contacts"], ensure_ascii=False, sort_keys=True))
+    if recalled.get("notes"):
+        lines.append("RELEVANTE NOTATER:")
+        for note in recalled["notes"]:
+            lines.append(f"- [{str(note.get('timestamp', ''))[:16]}] {note.get('note', '')}")
+    return "\n".join(lines)
+
+
+def build_messages(system_prompt, memory, history, instruction, recalled=None, summary=None):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": serialize_memory(memory)}
+    ]
+    # Sammendraget endres bare når eldre historikk oppsummeres på nytt i bakgrunnen
+    if summary:
+        messages.append({"role": "system", "content": f"SAMMENDRAG AV TIDLIGERE SAMTALE: {summary}"})
+    for entry in history:
+        messages.append({"role": entry["role"], "content": entry["content"]})
+    # Minner hentet for akkurat denne instruksjonen varierer, og legges derfor helt til slutt
+    if recalled and (recalled.get("contacts") or recalled.get("notes")):
+        messages.append({"role": "system", "content": serialize_recalled(recalled)})
+    messages.append({"role": "user", "content": instruction})
+    return messages
+
+
+def cache_params(slot_id=None):
+    params = {"cache_prompt": True}
+    if slot_id is not None:
+        params["id_slot"] = slot_id
+    return params
+
+
+def prompt_cache_stats(response):
+    timings = response.get("timings") or {}
+    usage = response.get("usage") or {}
+    cached = timings.get("cache_n")
+    if cached is None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    evaluated = timings.get("prompt_n")
+    if evaluated is None and usage.get("prompt_tokens") is not None:
+        evaluated = usage["prompt_tokens"] - (cached or 0)
+    return cached, evaluated
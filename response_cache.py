@@ -0,0 +1,179 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+SLOT_PATTERN = re.compile(r"⟦(\d+):([^⟧]+)⟧")
+# Instruksjoner som viser tilbake til samtalen ("oversett det", "samme som sist") betyr noe annet
+# neste gang, så de caches ikke
+REFERENCE_WORDS = {
+    "det", "den", "dette", "denne", "de", "dem", "disse", "han", "hun", "ham", "henne",
+    "igjen", "også", "forrige", "samme", "sist", "siste", "ja", "nei", "ok",
+    "it", "that", "this", "these", "those", "them", "again", "same", "previous", "last", "yes", "no"
+}
+
+
+def normalize_instruction(text):
+    # Tall, nektelser og preposisjoner beholdes: "skru på wifi" og "skru av wifi" er ulike spørsmål
+    return re.sub(r"\s+", " ", text.strip().lower()).rstrip("?!. ")
+
+
+def refers_to_history(text):
+    return any(word in REFERENCE_WORDS for word in re.findall(r"\w+", text.lower()))
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}{key}."))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for index, child in enumerate(value):
+            items.update(flatten(child, f"{prefix}{index}."))
+        return items
+    return {prefix.rstrip("."): value}
+
+
+def result_values(result):
+    try:
+        parsed = json.loads(result)
+    except (TypeError, ValueError):
+        return {"result": result}
+    if isinstance(parsed, (dict, list)):
+        return flatten(parsed)
+    return {"result": parsed}
+
+
+def build_template(reply, tool_results):
+    # Bytt ut verdier fra verktøyresultatene som står ordrett i svaret med plassholdere, så
+    # svaret kan fylles ut på nytt med ferske verdier uten å spørre modellen
+    template = reply
+    for index, result in enumerate(tool_results):
+        for path, value in result_values(result).items():
+            if isinstance(value, bool) or value is None:
+                continue
+            text = str(value)
+            if len(text) < 2:
+                continue
+            pattern = re.compile(rf"(?<![\w.]){re.escape(text)}(?![\w]|\.\d)")
+            template = pattern.sub(lambda _: f"⟦{index}:{path}⟧", template)
+    return template
+
+
+def render_template(template, tool_results):
+    values = [result_values(result) for result in tool_results]
+
+    def replace(match):
+        return str(values[int(match.group(1))][match.group(2)])
+
+    return SLOT_PATTERN.sub(replace, template)
+
+
+class ResponseCache:
+    def __init__(self, load, save, live_tools, state_tools, max_entries=200, ttl=86400, min_tokens=2):
+        self.load = load
+        self.save = save
+        self.live_tools = set(live_tools)
+        self.state_tools = state_tools
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        data = self.load() or {}
+        self.versions = data.get("versions", {})
+        for entry in data.get("entries", []):
+            self.entries[entry["key"]] = entry
+        self.loaded = True
+
+    def _persist(self):
+        self.save({"versions": self.versions, "entries": list(self.entries.values())})
+
+    def _key(self, instruction):
+        key = normalize_instruction(instruction)
+        if len(key.split()) < self.min_tokens or refers_to_history(key):
+            # Korte svar som "ja" eller "ok" og spørsmål om tidligere svar avhenger av samtalen
+            return None
+        return key
+
+    def _is_valid(self, entry):
+        if time.time() - entry["created"] > self.ttl:
+            return False
+        return all(self.versions.get(dep, 0) == version for dep, version in entry["deps"].items())
+
+    def invalidate(self, dep):
+        with self.lock:
+            self._ensure_loaded()
+            self.versions[dep] = self.versions.get(dep, 0) + 1
+            for key in [key for key, entry in self.entries.items() if dep in entry["deps"]]:
+                del self.entries[key]
+            self._persist()
+
+    def lookup(self, instruction, execute_tool):
+        key = self._key(instruction)
+        if key is None:
+            return None
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not self._is_valid(entry):
+                del self.entries[key]
+                self._persist()
+                return None
+            self.entries.move_to_end(key)
+
+        if not entry["tools"]:
+            return entry["reply"]
+
+        # Svar som bygger på enhetsverktøy kjører bare verktøyene på nytt og fylles ut igjen
+        fresh = [execute_tool(tool["name"], tool["args"]) for tool in entry["tools"]]
+        if fresh == [tool["result"] for tool in entry["tools"]]:
+            return entry["reply"]
+        if not SLOT_PATTERN.search(entry["template"]):
+            return None
+        try:
+            return render_template(entry["template"], fresh)
+        except (KeyError, IndexError):
+            return None
+
+    def store(self, instruction, reply, used_tools):
+        key = self._key(instruction)
+        if key is None or not reply:
+            return False
+        deps = {"memory": None}
+        live = []
+        for tool in used_tools:
+            if tool["name"] in self.live_tools:
+                live.append(tool)
+            elif tool["name"] in self.state_tools:
+                deps[self.state_tools[tool["name"]]] = None
+            else:
+                # Verktøy med sideeffekter eller innhold vi ikke kan sjekke, f.eks. filer
+                return False
+
+        with self.lock:
+            self._ensure_loaded()
+            self.entries[key] = {
+                "key": key,
+                "reply": reply,
+                "template": build_template(reply, [tool["result"] for tool in live]),
+                "tools": live,
+                "deps": {dep: self.versions.get(dep, 0) for dep in deps},
+                "created": time.time()
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._persist()
+        return True
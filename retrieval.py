@@ -0,0 +1,161 @@
+import json
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+STOPWORDS = {
+    "og", "i", "er", "det", "en", "et", "ei", "på", "til", "for", "med", "som", "av", "at", "har",
+    "jeg", "du", "meg", "deg", "vi", "de", "den", "om", "kan", "vil", "skal", "hva", "noe",
+    "the", "a", "an", "is", "are", "of", "to", "and", "in", "on", "for", "with", "what", "my", "me"
+}
+SUFFIXES = ("ene", "ane", "er", "en", "et", "ar", "e", "s")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def stem(token):
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [
+        stem(token)
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def estimate_tokens(text):
+    # Grovt anslag som holder for norsk/engelsk tekst med Qwen-tokenizeren
+    return max(1, len(text) // 4)
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.lengths
+
+    def add(self, doc_id, text):
+        if doc_id in self.lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, freq in terms.items():
+            self.postings[term][doc_id] = freq
+        self.doc_terms[doc_id] = list(terms)
+        length = sum(terms.values())
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        length = self.lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(doc_id, []):
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, top_k=None):
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, freq in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k] if top_k else ranked
+
+
+class MemoryRetriever:
+    def __init__(self, load_notes):
+        self.load_notes = load_notes
+        self.index = BM25Index()
+        self.notes = []
+        self.contacts = []
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        for note in self.load_notes():
+            self._index_note(note)
+        self.loaded = True
+
+    def _index_note(self, note):
+        doc_id = f"note:{len(self.notes)}"
+        self.notes.append(note)
+        self.index.add(doc_id, note.get("note", ""))
+
+    def add_note(self, note):
+        with self.lock:
+            if self.loaded:
+                self._index_note(note)
+
+    def _sync_contacts(self, contacts):
+        if contacts == self.contacts:
+            return
+        for index in range(len(self.contacts)):
+            self.index.remove(f"contact:{index}")
+        self.contacts = list(contacts)
+        for index, contact in enumerate(self.contacts):
+            self.index.add(f"contact:{index}", " ".join(str(value) for value in contact.values()))
+
+    def _lookup(self, doc_id):
+        kind, position = doc_id.split(":")
+        if kind == "note":
+            return "note", self.notes[int(position)]
+        return "contact", self.contacts[int(position)]
+
+    def select(self, memory, instruction, token_budget, top_k, recent_fallback=3):
+        with self.lock:
+            self._ensure_loaded()
+            self._sync_contacts(memory.get("contacts") or [])
+            return self._select(memory, instruction, token_budget, top_k, recent_fallback)
+
+    def _select(self, memory, instruction, token_budget, top_k, recent_fallback):
+        core = {key: value for key, value in memory.items() if key not in ("notes", "contacts")}
+        owners = [contact for contact in self.contacts if contact.get("relationship") == "Eier"]
+        if owners:
+            core["contacts"] = owners
+
+        candidates = [doc_id for doc_id, _ in self.index.search(instruction, top_k)]
+        if not candidates:
+            candidates = [f"note:{index}" for index in range(len(self.notes) - 1, -1, -1)][:recent_fallback]
+
+        recalled = {"contacts": [], "notes": []}
+        used = 0
+        for doc_id in candidates:
+            kind, item = self._lookup(doc_id)
+            if kind == "contact" and item in owners:
+                continue
+            cost = estimate_tokens(json.dumps(item, ensure_ascii=False))
+            if used + cost > token_budget:
+                continue
+            used += cost
+            recalled[f"{kind}s"].append(item)
+        # Notatene presenteres i kronologisk rekkefølge uansett rangering
+        recalled["notes"].sort(key=lambda note: str(note.get("timestamp", "")))
+        return core, recalled
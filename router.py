@@ -0,0 +1,130 @@
+import json
+import re
+
+# Enkle kommandoer som kan besvares med ett verktøykall uten å gå via LLM-en. Mønstrene må
+# matche hele meldingen, så "send batteristatus til Kari hver time" går fortsatt til modellen.
+DEFAULT_ROUTES = [
+    {
+        "intent": "battery",
+        "patterns": [
+            r"(hvordan står det med |hvor mye )?(batteri(et|status|nivå)?|strøm(men)?|lading)( har du)?",
+            r"(what is (the |your )?|how is (the |your )?)?battery( status| level)?"
+        ],
+        "tool": "get_battery_status",
+        "template": "Batteri: {percentage}% ({status}, {temperature:.0f}°C)"
+    },
+    {
+        "intent": "location",
+        "patterns": [
+            r"hvor er du( nå)?",
+            r"(din |send )?(posisjon|lokasjon|plassering)",
+            r"where are you( now)?",
+            r"(your |send )?location"
+        ],
+        "tool": "get_location",
+        "template": "Jeg er her: https://maps.google.com/?q={latitude},{longitude} (±{accuracy:.0f} m)"
+    },
+    {
+        "intent": "wifi",
+        "patterns": [
+            # Bare "nett" betyr også "hyggelig", så det krever status/info etter seg
+            r"(wifi|wi-fi|nettverk)( ?status| ?info)?",
+            r"nett ?(status|info)",
+            r"(wifi|wi-fi|network)( status| info)?"
+        ],
+        "tool": "get_wifi_info",
+        "template": "WiFi: {ssid} ({rssi} dBm, IP {ip})"
+    },
+    {
+        "intent": "device",
+        "patterns": [r"(enhets|telefon)info(rmasjon)?", r"device info"],
+        "tool": "get_device_info",
+        "template": "Operatør: {network_operator_name}, nett: {network_type}, roaming: {network_roaming}"
+    },
+    {
+        "intent": "clipboard",
+        "patterns": [r"(hva er i |les )?utklippstavlen?", r"(read |get )?(the )?clipboard"],
+        "tool": "get_clipboard",
+        "template": "Utklippstavle: {result}"
+    },
+    {
+        "intent": "list_tasks",
+        "patterns": [
+            r"((list|vis|hvilke) )?(planlagte )?oppgaver( har du)?",
+            r"(list |show )?(scheduled )?tasks"
+        ],
+        "tool": "list_tasks",
+        "format": "tasks"
+    },
+    {
+        "intent": "cancel_task",
+        "patterns": [
+            r"(avbryt|stopp|kanseller|slett|deaktiver) (oppgave(n)? )?(?P<task_id>task_\d+(_\d+)?)",
+            r"(cancel|stop|delete|disable) (task )?(?P<task_id>task_\d+(_\d+)?)"
+        ],
+        "tool": "cancel_task",
+        "template": "{result}: {task_id}"
+    }
+]
+
+
+def normalize(text):
+    return re.sub(r"\s+", " ", text.strip().lower()).rstrip("?!. ")
+
+
+def compile_routes(routes):
+    compiled = []
+    for route in routes:
+        patterns = [re.compile(pattern, re.IGNORECASE) for pattern in route.get("patterns", [])]
+        compiled.append((route, patterns))
+    return compiled
+
+
+def match_route(text, compiled_routes):
+    normalized = normalize(text)
+    for route, patterns in compiled_routes:
+        for pattern in patterns:
+            match = pattern.fullmatch(normalized)
+            if match:
+                args = {key: value for key, value in match.groupdict().items() if value is not None}
+                return route, args
+    return None
+
+
+def format_tasks(result):
+    tasks = [task for task in json.loads(result) if task.get("enabled", True)]
+    if not tasks:
+        return "Ingen aktive oppgaver"
+    lines = [f"{task['id']}: {task.get('name')} (neste {str(task.get('next_run'))[:16]})" for task in tasks]
+    return "\n".join(lines)
+
+
+FORMATTERS = {"tasks": format_tasks}
+
+
+def render(route, args, result):
+    formatter = FORMATTERS.get(route.get("format"))
+    if formatter is not None:
+        return formatter(result)
+    try:
+        values = json.loads(result)
+    except (TypeError, ValueError):
+        values = None
+    if not isinstance(values, dict):
+        values = {}
+    values.setdefault("result", result)
+    values.update(args)
+    return route.get("template", "{result}").format_map(values)
+
+
+def route_command(text, compiled_routes, execute_tool):
+    matched = match_route(text, compiled_routes)
+    if matched is None:
+        return None
+    route, args = matched
+    result = execute_tool(route["tool"], dict(route.get("args", {}), **args))
+    try:
+        return render(route, args, result)
+    except (KeyError, ValueError, TypeError, IndexError):
+        # Resultatet hadde ikke forventet form (f.eks. en feilmelding), la LLM-en ta det
+        return None
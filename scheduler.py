@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+MISFIRE_RUN_ONCE = "run_once"
+MISFIRE_SKIP = "skip"
+MISFIRE_CATCH_UP = "catch_up"
+
+
+def parse_time(value):
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def next_daily_run(daily_time, after):
+    hour, minute = daily_time.split(":")
+    next_run = after.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+    if next_run <= after:
+        next_run += timedelta(days=1)
+    return next_run
+
+
+def compute_next_run(task, after):
+    schedule_type = task.get("schedule_type", "interval")
+    if schedule_type == "interval":
+        interval_minutes = int(task.get("interval_minutes") or 0)
+        if interval_minutes <= 0:
+            return None
+        return after + timedelta(minutes=interval_minutes)
+    if schedule_type == "daily":
+        return next_daily_run(task.get("daily_time") or "06:00", after)
+    return None
+
+
+class Scheduler:
+    def __init__(self, load_tasks, save_tasks, run_task, misfire_grace=timedelta(minutes=5),
+                 default_misfire_policy=MISFIRE_RUN_ONCE, max_catch_up=10, max_sleep=60, on_run=None,
+                 run_batch=None):
+        self.load_tasks = load_tasks
+        self.save_tasks = save_tasks
+        self.run_task = run_task
+        # run_batch får alle (oppgave, antall kjøringer) som forfaller samtidig; uten den kjøres de etter hverandre
+        self.run_batch = run_batch
+        self.on_run = on_run
+        self.misfire_grace = misfire_grace
+        self.default_misfire_policy = default_misfire_policy
+        self.max_catch_up = max_catch_up
+        # Monotonisk klokke står stille mens telefonen sover, så vi sjekker veggklokken minst så ofte
+        self.max_sleep = max_sleep
+
+        self.tasks = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition(threading.RLock())
+        self.loaded = False
+        self.stopped = False
+        self.thread = None
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        self.tasks = {}
+        self.heap = []
+        for task in self.load_tasks():
+            if task.get("id"):
+                self.tasks[task["id"]] = task
+                self._push(task)
+        self.loaded = True
+
+    def _push(self, task):
+        if not task.get("enabled", True) or not task.get("next_run"):
+            return
+        try:
+            due = parse_time(task["next_run"])
+        except (TypeError, ValueError):
+            return
+        heapq.heappush(self.heap, (due, next(self.counter), task["id"], task["next_run"]))
+
+    def _persist(self):
+        self.save_tasks(list(self.tasks.values()))
+
+    def new_task_id(self, base):
+        with self.condition:
+            self._ensure_loaded()
+            task_id = base
+            suffix = 1
+            while task_id in self.tasks:
+                task_id = f"{base}_{suffix}"
+                suffix += 1
+            return task_id
+
+    def add(self, task):
+        with self.condition:
+            self._ensure_loaded()
+            self.tasks[task["id"]] = task
+            self._push(task)
+            self._persist()
+            self.condition.notify_all()
+
+    def cancel(self, task_id):
+        with self.condition:
+            self._ensure_loaded()
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            # Heap-oppføringen blir liggende og forkastes når den poppes
+            task["enabled"] = False
+            self._persist()
+            self.condition.notify_all()
+            return True
+
+    def list(self):
+        with self.condition:
+            self._ensure_loaded()
+            return list(self.tasks.values())
+
+    def next_due(self):
+        with self.condition:
+            self._ensure_loaded()
+            while self.heap and not self._is_current(self.heap[0]):
+                heapq.heappop(self.heap)
+            return self.heap[0][0] if self.heap else None
+
+    def _is_current(self, entry):
+        task = self.tasks.get(entry[2])
+        return task is not None and task.get("enabled", True) and task.get("next_run") == entry[3]
+
+    def _runs_for(self, task, due, now):
+        if now - due <= self.misfire_grace:
+            return 1
+        policy = task.get("misfire_policy") or self.default_misfire_policy
+        if policy == MISFIRE_SKIP:
+            return 0
+        if policy == MISFIRE_CATCH_UP:
+            runs = 0
+            occurrence = due
+            while occurrence is not None and occurrence <= now and runs < self.max_catch_up:
+                runs += 1
+                occurrence = compute_next_run(task, occurrence)
+            return max(runs, 1)
+        return 1
+
+    def run_due(self, now=None):
+        now = now or datetime.utcnow()
+        due_tasks = []
+        with self.condition:
+            self._ensure_loaded()
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
+                if self._is_current(entry):
+                    due_tasks.append((entry[0], self.tasks[entry[2]]))
+
+        if not due_tasks:
+            return 0
+
+        # Handlingene kjøres uten lås, slik at verktøy som schedule_task/cancel_task ikke blokkeres
+        executed = [(task, self._runs_for(task, due, now)) for due, task in due_tasks]
+        if self.run_batch is not None:
+            try:
+                self.run_batch(executed)
+            except Exception as e:
+                print(f"Feil under oppgavekjøring: {e}")
+        else:
+            for task, runs in executed:
+                for _ in range(runs):
+                    try:
+                        self.run_task(task)
+                    except Exception as e:
+                        print(f"Feil under oppgave {task.get('id')}: {e}")
+
+        with self.condition:
+            for task, runs in executed:
+                if runs:
+                    task["last_run"] = now.isoformat()
+                next_run = compute_next_run(task, now)
+                if next_run is None:
+                    task["enabled"] = False
+                else:
+                    task["next_run"] = next_run.isoformat()
+                    self._push(task)
+            self._persist()
+        if self.on_run is not None:
+            self.on_run(executed)
+        return len(executed)
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def _loop(self):
+        while not self.stopped:
+            with self.condition:
+                due = self.next_due()
+                timeout = self.max_sleep
+                if due is not None:
+                    timeout = min(timeout, max(0.0, (due - datetime.utcnow()).total_seconds()))
+                if timeout > 0:
+                    self.condition.wait(timeout)
+            if self.stopped:
+                break
+            try:
+                self.run_due()
+            except Exception as e:
+                print(f"Feil i planleggeren: {e}")
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopped = False
+        self.thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wake()
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+def fetch_new_messages(list_page, last_id, page_size=5, max_page_size=100):
+    # Sidene hentes nyeste først. Vi stopper så snart en side inneholder en melding vi allerede
+    # har sett, så en rolig innboks koster én liten side, og et stort skred hentes helt ut
+    new_messages = {}
+    offset = 0
+    limit = page_size
+    while True:
+        page = list_page(offset, limit)
+        if not page:
+            break
+        reached_seen = False
+        for msg in page:
+            msg_id = int(msg.get("_id", 0))
+            if msg_id > last_id:
+                new_messages[msg_id] = msg
+            else:
+                reached_seen = True
+        if reached_seen or len(page) < limit:
+            break
+        offset += limit
+        limit = min(limit * 2, max_page_size)
+    return [new_messages[msg_id] for msg_id in sorted(new_messages)]
+
+
+class AdaptivePoller:
+    def __init__(self, fast_interval=2, max_interval=60, active_window=120, backoff=2.0):
+        self.fast_interval = fast_interval
+        self.max_interval = max_interval
+        self.active_window = active_window
+        self.backoff = backoff
+        self.interval = fast_interval
+        self.last_activity = time.monotonic()
+        self.wake_event = threading.Event()
+
+    def record(self, activity):
+        now = time.monotonic()
+        if activity:
+            self.last_activity = now
+        if now - self.last_activity < self.active_window:
+            self.interval = self.fast_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def wait(self):
+        woken = self.wake_event.wait(self.interval)
+        self.wake_event.clear()
+        return woken
+
+    def wake(self, activity=True):
+        # Brukes når noe annet enn innboksen tilsier at et svar kan komme snart, f.eks. en
+        # planlagt oppgave som nettopp sendte en SMS
+        if activity:
+            self.last_activity = time.monotonic()
+            self.interval = self.fast_interval
+        self.wake_event.set()
@@ -0,0 +1,98 @@
+import itertools
+import threading
+from collections import deque
+
+
+class SmsQueue:
+    def __init__(self, load_pending, save_pending, handle, workers=1, key=None, priority=None):
+        self.load_pending = load_pending
+        self.save_pending = save_pending
+        self.handle = handle
+        self.workers = workers
+        # key grupperer meldinger i samtaler: samme samtale behandles én melding om gangen,
+        # ulike samtaler kan behandles samtidig. Lavest priority velges først.
+        self.key = key or (lambda message: None)
+        self.priority = priority or (lambda key: 0)
+        self.pending = {}
+        self.queues = {}
+        self.busy = set()
+        self.served = {}
+        self.turns = itertools.count()
+        self.active = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.threads = []
+
+    def _persist(self):
+        self.save_pending(list(self.pending.values()))
+
+    def _put(self, message):
+        self.queues.setdefault(self.key(message), deque()).append(message)
+
+    def start(self):
+        if self.threads:
+            return
+        # Meldinger som ikke ble ferdig behandlet før en omstart tas opp igjen
+        with self.lock:
+            for message in self.load_pending() or []:
+                self.pending[message["id"]] = message
+                self._put(message)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(index,), name=f"sms-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def enqueue(self, messages):
+        added = []
+        with self.lock:
+            for message in messages:
+                if message["id"] in self.pending:
+                    continue
+                self.pending[message["id"]] = message
+                self._put(message)
+                added.append(message)
+            if added:
+                self._persist()
+                self.condition.notify_all()
+        return len(added)
+
+    def _next(self):
+        ready = [key for key, messages in self.queues.items() if messages and key not in self.busy]
+        if not ready:
+            return None, None
+        # Prioritet først, deretter samtalen som har ventet lengst siden sist den fikk en tur,
+        # så én pratsom kontakt ikke kan holde de andre ute
+        key = min(ready, key=lambda item: (self.priority(item), self.served.get(item, -1)))
+        self.busy.add(key)
+        self.served[key] = next(self.turns)
+        return key, self.queues[key].popleft()
+
+    def _work(self, index):
+        while True:
+            with self.condition:
+                key, message = self._next()
+                while message is None:
+                    self.condition.wait()
+                    key, message = self._next()
+                self.active += 1
+            try:
+                self.handle(message, index)
+            except Exception as e:
+                print(f"Feil under behandling av SMS {message.get('id')}: {e}")
+            finally:
+                with self.condition:
+                    self.pending.pop(message["id"], None)
+                    self._persist()
+                    self.active -= 1
+                    self.busy.discard(key)
+                    if not self.queues.get(key):
+                        self.queues.pop(key, None)
+                    self.condition.notify_all()
+
+    def size(self):
+        with self.lock:
+            return len(self.pending)
+
+    def is_idle(self):
+        with self.lock:
+            return not self.pending and self.active == 0
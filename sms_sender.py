@@ -0,0 +1,187 @@
+import threading
+import time
+
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Tegn i utvidelsestabellen koster to septetter (escape + tegn)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+
+def sms_encoding(text):
+    return "gsm7" if all(ch in GSM7_BASIC or ch in GSM7_EXTENDED for ch in text) else "ucs2"
+
+
+def char_cost(ch, encoding):
+    if encoding == "gsm7":
+        return 2 if ch in GSM7_EXTENDED else 1
+    # Tegn utenfor BMP (f.eks. emoji) tar et surrogatpar, altså to UCS-2-enheter
+    return 2 if ord(ch) > 0xFFFF else 1
+
+
+def split_message(text, gsm7_limit=160, ucs2_limit=70):
+    text = text.strip()
+    encoding = sms_encoding(text)
+    limit = gsm7_limit if encoding == "gsm7" else ucs2_limit
+    parts = []
+    current = []
+    cost = 0
+    for ch in text:
+        ch_cost = char_cost(ch, encoding)
+        if cost + ch_cost > limit:
+            chunk = "".join(current)
+            # Del helst ved mellomrom eller linjeskift, så ord ikke kuttes midt i
+            cut = max(chunk.rfind(" "), chunk.rfind("\n"))
+            if cut > len(chunk) // 2:
+                parts.append(chunk[:cut].rstrip())
+                current = list(chunk[cut + 1:])
+            else:
+                parts.append(chunk)
+                current = []
+            cost = sum(char_cost(item, encoding) for item in current)
+        current.append(ch)
+        cost += ch_cost
+    if current:
+        parts.append("".join(current))
+    return [part for part in parts if part.strip()]
+
+
+class SmsSender:
+    def __init__(self, send, load_pending=None, save_pending=None, rate=30, period=1800, min_interval=1.0,
+                 retries=3, backoff=5, dedupe_window=60):
+        self.send_part = send
+        self.load_pending = load_pending
+        self.save_pending = save_pending
+        self.rate = rate
+        self.period = period
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.dedupe_window = dedupe_window
+        self.tokens = float(rate)
+        self.refilled = time.monotonic()
+        self.last_sent = 0.0
+        self.pending = []
+        self.recent = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def _persist(self):
+        if self.save_pending is not None:
+            self.save_pending([
+                {
+                    "number": item["number"], "parts": item["parts"], "attempts": item["attempts"],
+                    "attachment": item.get("attachment")
+                }
+                for item in self.pending
+            ])
+
+    def start(self):
+        if self.thread is not None:
+            return
+        # Meldinger som ikke ble sendt før en omstart sendes nå
+        with self.condition:
+            for item in (self.load_pending() if self.load_pending else None) or []:
+                self.pending.append(dict(item, ready_at=0.0))
+        self.thread = threading.Thread(target=self._loop, name="sms-sender", daemon=True)
+        self.thread.start()
+
+    def send(self, number, text, attachment=None):
+        text = (text or "").strip()
+        if not text and not attachment:
+            return False
+        key = (number, text, attachment)
+        with self.condition:
+            now = time.monotonic()
+            self.recent = {
+                recent_key: sent_at for recent_key, sent_at in self.recent.items()
+                if now - sent_at < self.dedupe_window
+            }
+            if key in self.recent:
+                return False
+            self.recent[key] = now
+            # En MMS sendes som én melding med vedlegget, uansett tekstlengde
+            parts = [text] if attachment else split_message(text)
+            self.pending.append({
+                "number": number, "parts": parts, "attempts": 0, "ready_at": 0.0, "attachment": attachment
+            })
+            self._persist()
+            self.condition.notify_all()
+        return True
+
+    def forget(self, number):
+        # Et nytt spørsmål kan få samme svar som forrige, så det skal ikke stoppes som duplikat
+        with self.condition:
+            self.recent = {key: sent_at for key, sent_at in self.recent.items() if key[0] != number}
+
+    def _next_ready(self, now):
+        waiting = set()
+        wait = None
+        for item in self.pending:
+            # Meldinger til samme nummer sendes i rekkefølge, også når en av dem venter på nytt forsøk
+            if item["number"] in waiting:
+                continue
+            if item["ready_at"] <= now:
+                return item, None
+            waiting.add(item["number"])
+            delay = item["ready_at"] - now
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _rate_wait(self, now):
+        self.tokens = min(float(self.rate), self.tokens + (now - self.refilled) * self.rate / self.period)
+        self.refilled = now
+        wait = self.last_sent + self.min_interval - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * self.period / self.rate)
+        return wait
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                item, wait = self._next_ready(now)
+                if item is None:
+                    self.condition.wait(wait)
+                    continue
+                wait = self._rate_wait(now)
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.tokens -= 1
+                self.last_sent = now
+                part = item["parts"][0]
+
+            try:
+                if item.get("attachment"):
+                    self.send_part(item["number"], part, item["attachment"])
+                else:
+                    self.send_part(item["number"], part)
+                error = None
+            except Exception as e:
+                error = e
+
+            with self.condition:
+                if error is None:
+                    item["parts"].pop(0)
+                    item["attempts"] = 0
+                    if not item["parts"]:
+                        self.pending.remove(item)
+                else:
+                    item["attempts"] += 1
+                    if item["attempts"] > self.retries:
+                        print(f"Ga opp SMS til {item['number']} etter {item['attempts']} forsøk: {error}")
+                        self.pending.remove(item)
+                    else:
+                        item["ready_at"] = time.monotonic() + self.backoff * 2 ** (item["attempts"] - 1)
+                self._persist()
+                self.condition.notify_all()
+
+    def size(self):
+        with self.condition:
+            return len(self.pending)
+
+    def is_idle(self):
+        with self.condition:
+            return not self.pending
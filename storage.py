@@ -0,0 +1,350 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def load_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        print(f"Kunne ikke lese {path}: {e}")
+        return default
+
+
+def save_text(path, text):
+    # Skriv til en midlertidig fil i samme mappe og bytt den inn atomisk, så et krasj
+    # midt i skrivingen aldri etterlater en halvskrevet fil
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_json(path, payload):
+    save_text(path, json.dumps(payload, ensure_ascii=False, indent=2))
+
+
+class JsonFileStorage:
+    def __init__(self, data_dir, files):
+        self.data_dir = data_dir
+        self.files = files
+        self.lock = threading.RLock()
+
+    def _path(self, key):
+        return os.path.join(self.data_dir, self.files.get(key, f"{key}.json"))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def version(self, key):
+        try:
+            return os.stat(self._path(key)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, key, default=None):
+        return load_json(self._path(key), default)
+
+    def put(self, key, value):
+        with self.lock:
+            save_json(self._path(key), value)
+
+    def append(self, key, item, max_items=None):
+        with self.lock:
+            items = load_json(self._path(key), [])
+            items.append(item)
+            if max_items:
+                items = items[-max_items:]
+            save_json(self._path(key), items)
+
+    def extend(self, key, new_items, max_items=None):
+        with self.lock:
+            items = load_json(self._path(key), [])
+            items.extend(new_items)
+            if max_items:
+                items = items[-max_items:]
+            save_json(self._path(key), items)
+
+    def items(self, key, limit=None):
+        items = load_json(self._path(key), [])
+        return items[-limit:] if limit else items
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_key_id ON records (key, id)")
+
+    def exists(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM documents WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                row = self.conn.execute("SELECT 1 FROM records WHERE key = ? LIMIT 1", (key,)).fetchone()
+            return row is not None
+
+    def version(self, key):
+        # data_version endres bare når en annen tilkobling skriver til databasen
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM documents WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO documents (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, payload)
+            )
+
+    def append(self, key, item, max_items=None):
+        self.extend(key, [item], max_items)
+
+    def extend(self, key, new_items, max_items=None):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO records (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(item, ensure_ascii=False)) for item in new_items]
+                )
+                if max_items:
+                    self.conn.execute(
+                        "DELETE FROM records WHERE key = ? AND id <= ("
+                        "SELECT id FROM records WHERE key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (key, key, max_items)
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def items(self, key, limit=None):
+        with self.lock:
+            if limit:
+                rows = self.conn.execute(
+                    "SELECT value FROM (SELECT id, value FROM records WHERE key = ? "
+                    "ORDER BY id DESC LIMIT ?) ORDER BY id",
+                    (key, limit)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT value FROM records WHERE key = ? ORDER BY id", (key,)
+                ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Holder utvalgte nøkler som levende objekter i minnet og skriver endringer samlet i bakgrunnen.
+# Verdier gitt til put eies av cachen: les dem med get og kall put igjen etter endring. En nøkkel
+# lastes på nytt bare hvis den er endret utenfra (mtime for JSON, data_version for SQLite)
+# og ikke har uskrevne endringer. "history.1234" caches hvis "history" er med i keys.
+class CachedStorage:
+
+    def __init__(self, storage, keys, flush_delay=2.0):
+        self.storage = storage
+        self.keys = set(keys)
+        self.flush_delay = flush_delay
+        self.documents = {}
+        self.lists = {}
+        self.versions = {}
+        self.dirty = set()
+        self.pending = {}
+        self.max_items = {}
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _cached(self, key):
+        return key.partition(".")[0] in self.keys
+
+    def _version(self, key):
+        version = getattr(self.storage, "version", None)
+        return version(key) if version else None
+
+    def _fresh(self, key, cache):
+        if key not in cache:
+            return False
+        if key in self.dirty:
+            return True
+        return self.versions.get(key) == self._version(key)
+
+    def exists(self, key):
+        with self.lock:
+            # get lagrer None for nøkler som manglet, så selve oppslaget betyr ikke at nøkkelen finnes
+            if self.documents.get(key) is not None or self.lists.get(key):
+                return True
+        return self.storage.exists(key)
+
+    def get(self, key, default=None):
+        if not self._cached(key):
+            return self.storage.get(key, default)
+        with self.lock:
+            if not self._fresh(key, self.documents):
+                self.versions[key] = self._version(key)
+                self.documents[key] = self.storage.get(key)
+            value = self.documents[key]
+        return default if value is None else value
+
+    def put(self, key, value):
+        if not self._cached(key):
+            return self.storage.put(key, value)
+        with self.lock:
+            self.documents[key] = value
+            self._mark_dirty(key)
+
+    def _load_list(self, key):
+        if not self._fresh(key, self.lists):
+            self.versions[key] = self._version(key)
+            self.lists[key] = self.storage.items(key)
+
+    def items(self, key, limit=None):
+        if not self._cached(key):
+            return self.storage.items(key, limit)
+        with self.lock:
+            self._load_list(key)
+            items = self.lists[key]
+            return items[-limit:] if limit else list(items)
+
+    def append(self, key, item, max_items=None):
+        self.extend(key, [item], max_items)
+
+    def extend(self, key, new_items, max_items=None):
+        if not self._cached(key):
+            return self.storage.extend(key, new_items, max_items)
+        with self.lock:
+            self._load_list(key)
+            items = self.lists[key]
+            items.extend(new_items)
+            pending = self.pending.setdefault(key, [])
+            pending.extend(new_items)
+            if max_items:
+                del items[:-max_items]
+                del pending[:-max_items]
+                self.max_items[key] = max_items
+            self._mark_dirty(key)
+
+    def _mark_dirty(self, key):
+        self.dirty.add(key)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._flush_loop, name="storage-flush", daemon=True)
+            self.thread.start()
+        self.wakeup.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.dirty:
+                    self.wakeup.wait()
+            # Vent litt så raske endringer etter hverandre havner i samme skriving
+            time.sleep(self.flush_delay)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Kunne ikke skrive til lagring: {e}")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                writes = []
+                for key in self.dirty:
+                    if key in self.pending:
+                        writes.append((key, None, self.pending.pop(key), self.max_items.get(key)))
+                    else:
+                        writes.append((key, self.documents.get(key), None, None))
+                self.dirty = set()
+            for index, (key, value, new_items, max_items) in enumerate(writes):
+                try:
+                    if new_items is None:
+                        self.storage.put(key, value)
+                    else:
+                        self.storage.extend(key, new_items, max_items)
+                except BaseException:
+                    self._restore(writes[index:])
+                    raise
+                with self.lock:
+                    if key not in self.dirty:
+                        self.versions[key] = self._version(key)
+
+    def _restore(self, writes):
+        with self.lock:
+            for key, _, new_items, _ in writes:
+                if new_items is not None:
+                    self.pending[key] = new_items + self.pending.get(key, [])
+                self.dirty.add(key)
+
+    def close(self):
+        self.flush()
+        self.storage.close()
+
+
+def open_storage(backend, data_dir, files):
+    if backend == "sqlite":
+        return SqliteStorage(os.path.join(data_dir, "henry.db"))
+    if backend == "json":
+        return JsonFileStorage(data_dir, files)
+    raise ValueError(f"Ukjent lagringsbackend: {backend}")
+
+
+def migrate_json_files(storage, documents, lists):
+    migrated = []
+    for key, path in documents.items():
+        if storage.exists(key) or not os.path.exists(path):
+            continue
+        value = load_json(path, None)
+        if value is not None:
+            storage.put(key, value)
+            migrated.append(path)
+    for key, (path, field) in lists.items():
+        if storage.exists(key) or not os.path.exists(path):
+            continue
+        value = load_json(path, None)
+        if field and isinstance(value, dict):
+            value = value.get(field)
+        if value:
+            storage.extend(key, value)
+            migrated.append(path)
+    return migrated
@@ -0,0 +1,77 @@
+import json
+import threading
+from concurrent.futures import Future
+
+
+class TaskBatch:
+    def __init__(self, execute_tool, read_only, executor, default_number=None):
+        self.execute_tool = execute_tool
+        self.read_only = set(read_only)
+        self.executor = executor
+        self.default_number = default_number
+        self.results = {}
+        self.outbox = {}
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "deduplicated": 0, "coalesced": 0}
+
+    def call(self, name, args):
+        if name not in self.read_only:
+            return self.execute_tool(name, args)
+        key = (name, json.dumps(args or {}, sort_keys=True))
+        with self.lock:
+            future = self.results.get(key)
+            owner = future is None
+            if owner:
+                # Første oppgave som ber om et lesende kall utfører det, de andre venter på samme svar
+                future = self.results[key] = Future()
+                self.stats["calls"] += 1
+            else:
+                self.stats["deduplicated"] += 1
+        if owner:
+            try:
+                future.set_result(self.execute_tool(name, args))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def tool_caller(self, task):
+        if not task.get("coalesce_sms"):
+            return self.call
+
+        def call(name, args):
+            if name != "send_sms":
+                return self.call(name, args)
+            number = args.get("number") or self.default_number
+            with self.lock:
+                self.outbox.setdefault(number, []).append(args.get("message", ""))
+                self.stats["coalesced"] += 1
+            return f"SMS til {number} sendes samlet"
+
+        return call
+
+    def run(self, batch, run_task):
+        def run_all(task, runs):
+            call_tool = self.tool_caller(task)
+            for _ in range(runs):
+                try:
+                    run_task(task, call_tool)
+                except Exception as e:
+                    print(f"Feil under oppgave {task.get('id')}: {e}")
+
+        jobs = [(task, runs) for task, runs in batch if runs]
+        if len(jobs) == 1:
+            run_all(*jobs[0])
+        else:
+            # Oppgavene er uavhengige; kjøringene av samme oppgave holdes i rekkefølge
+            for future in [self.executor.submit(run_all, task, runs) for task, runs in jobs]:
+                future.result()
+        self.flush_outbox()
+        return self.stats
+
+    def flush_outbox(self):
+        with self.lock:
+            outbox, self.outbox = self.outbox, {}
+        for number, messages in outbox.items():
+            text = "\n\n".join(message for message in messages if message)
+            if text:
+                self.execute_tool("send_sms", {"number": number, "message": text})
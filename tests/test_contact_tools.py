@@ -0,0 +1,55 @@
+import json
+
+import android_agent
+
+
+def tool_call(call_id, name, args):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+
+def test_contact_cannot_run_tools_outside_allowed_list(tmp_path, monkeypatch):
+    monkeypatch.setattr(android_agent, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(android_agent, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(android_agent, "_storage", None)
+    monkeypatch.setattr(android_agent, "MY_NUMBER", "40000000")
+    monkeypatch.setattr(android_agent.context_manager.counter, "tokenize", None)
+
+    executed = []
+    sent = []
+    monkeypatch.setattr(android_agent, "execute_tool", lambda name, args: executed.append((name, args)) or "ok")
+    monkeypatch.setattr(android_agent.sms_sender, "send", lambda number, text: sent.append((number, text)))
+
+    requests = []
+    responses = [
+        {"choices": [{"message": {"role": "assistant", "content": None, "tool_calls": [
+            tool_call("1", "list_files", {"path": "/sdcard"}),
+            tool_call("2", "get_location", {}),
+            tool_call("3", "send_sms", {"number": "40000000", "message": "Hei"})
+        ]}}]},
+        {"choices": [{"message": {"role": "assistant", "content": "Ferdig"}}]}
+    ]
+
+    def complete(messages, **kwargs):
+        requests.append([dict(message) for message in messages])
+        return responses[len(requests) - 1]
+
+    monkeypatch.setattr(android_agent.llm_pool, "complete", complete)
+
+    conversation = {
+        "key": "41111111", "number": "41111111", "name": "Kari",
+        "relationship": "Søster", "owner": False, "tools": []
+    }
+    reply = android_agent.process_llm_task("Hvor er han?", slot_id=None, conversation=conversation)
+
+    assert reply == "Ferdig"
+    # send_sms er tillatt, men går alltid tilbake til kontakten selv
+    assert executed == [("send_sms", {"number": "41111111", "message": "Hei"})]
+    results = {message["name"]: message["content"] for message in requests[1] if message["role"] == "tool"}
+    assert results["list_files"] == "Verktøyet list_files er ikke tilgjengelig"
+    assert results["get_location"] == "Verktøyet get_location er ikke tilgjengelig"
+    assert sent == [("41111111", "Ferdig")]
+    # Eierens nummer og profil skal ikke stå i promptet kontakten får svar fra
+    prompt = json.dumps(requests[0], ensure_ascii=False)
+    assert "40000000" not in prompt
+    assert "Ditt navn" not in prompt
+    android_agent.get_storage().flush()
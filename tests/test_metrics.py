@@ -0,0 +1,21 @@
+import json
+
+from metrics import Metrics
+
+
+def test_export_escapes_label_values(tmp_path):
+    metrics = Metrics()
+    metrics.observe("tool", 0.1, tool='a"b\\c\nd')
+    metrics.inc("sms", command='x"y')
+
+    prom_path = tmp_path / "metrics.prom"
+    jsonl_path = tmp_path / "metrics.jsonl"
+    metrics.export(str(prom_path), str(jsonl_path))
+
+    text = prom_path.read_text(encoding="utf-8")
+    assert 'tool="a\\"b\\\\c\\nd"' in text
+    assert 'henry_sms_total{command="x\\"y"} 1' in text
+    # Hver serie står på én linje, også når labelverdien inneholder linjeskift
+    assert all(line.startswith(("#", "henry_")) for line in text.splitlines() if line)
+    records = [json.loads(line) for line in jsonl_path.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 1
@@ -0,0 +1,17 @@
+from prompt_builder import history_window, number_history
+
+
+def test_legacy_history_continues_numbering_by_position():
+    legacy = [{"role": "user", "content": f"m{index}"} for index in range(20)]
+    history = legacy + [{"role": "user", "content": "ny", "seq": 20}]
+
+    numbered = number_history(history)
+    assert [entry["seq"] for entry in numbered] == list(range(21))
+
+    # Et utsnitt av halen får samme nummer som i hele listen
+    assert [entry["seq"] for entry in number_history(history[-5:])] == [16, 17, 18, 19, 20]
+    # Uten nummererte meldinger brukes antall eldre meldinger utenfor utsnittet
+    assert [entry["seq"] for entry in number_history(legacy[-3:], offset=17)] == [17, 18, 19]
+
+    window = history_window(numbered, 12, 6)
+    assert [entry["content"] for entry in window][-2:] == ["m19", "ny"]
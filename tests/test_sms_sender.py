@@ -0,0 +1,31 @@
+import time
+
+from sms_sender import SmsSender
+
+
+def wait_until_idle(sender, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not sender.is_idle() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sender.is_idle()
+
+
+def test_mms_is_queued_retried_and_deduplicated():
+    calls = []
+    saved = []
+
+    def send(number, text, attachment=None):
+        calls.append((number, text, attachment))
+        if len(calls) == 1:
+            raise RuntimeError("termux-sms-send feilet med kode 1")
+
+    sender = SmsSender(send, save_pending=saved.append, min_interval=0, backoff=0.01)
+    sender.start()
+
+    assert sender.send("41111111", "Se her " * 40, "/sdcard/bilde.mms.jpg")
+    assert not sender.send("41111111", "Se her " * 40, "/sdcard/bilde.mms.jpg")
+    wait_until_idle(sender)
+
+    # Lang tekst deles ikke opp når den følger med et vedlegg, og feilet sending prøves på nytt
+    assert calls == [("41111111", ("Se her " * 40).strip(), "/sdcard/bilde.mms.jpg")] * 2
+    assert saved[0][0]["attachment"] == "/sdcard/bilde.mms.jpg"
@@ -0,0 +1,37 @@
+from tool_selection import REQUEST_TOOLS, ToolSelector
+
+
+def tool(name, description):
+    return {"type": "function", "function": {"name": name, "description": description, "parameters": {}}}
+
+
+TOOLS = [
+    tool("get_battery_status", "Henter batteristatus"),
+    tool("send_sms", "Sender SMS"),
+    tool("take_photo", "Tar et bilde"),
+    tool("list_files", "Lister filer")
+]
+
+
+def test_selection_uses_fixed_tiers_with_stable_order():
+    selector = ToolSelector(TOOLS, tiers=[["send_sms"], ["get_battery_status"]], top_k=2)
+
+    assert selector.select("hei der") == {"send_sms"}
+    assert selector.select("batteri") == {"send_sms", "get_battery_status"}
+    # Ulike instruksjoner i samme nivå gir nøyaktig samme skjemablokk
+    assert selector.schemas(selector.select("ta et bilde")) == selector.schemas(selector.select("filer"))
+
+    names = [schema["function"]["name"] for schema in selector.schemas({"send_sms", "get_battery_status"})]
+    assert names == ["send_sms", "get_battery_status", REQUEST_TOOLS["function"]["name"]]
+
+
+def test_expand_moves_to_the_next_tier():
+    selector = ToolSelector(TOOLS, tiers=[["send_sms"], ["get_battery_status"]], top_k=2)
+
+    names, added = selector.expand({"send_sms"}, "get_battery_status")
+    assert names == {"send_sms", "get_battery_status"}
+    assert added == ["get_battery_status"]
+
+    names, added = selector.expand(names, "noe helt annet")
+    assert names == {tool["function"]["name"] for tool in TOOLS}
+    assert added == ["list_files", "take_photo"]
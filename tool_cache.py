@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+
+class ToolCache:
+    def __init__(self, policies):
+        self.policies = policies
+        self.entries = {}
+        self.inflight = {}
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0, "deduplicated": 0, "stale": 0})
+        self.lock = threading.Lock()
+
+    def call(self, name, args, fetch):
+        policy = self.policies.get(name)
+        if policy is None:
+            return fetch()
+
+        key = (name, json.dumps(args or {}, sort_keys=True))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < policy.get("ttl", 0):
+                self.stats[name]["hits"] += 1
+                return entry[1]
+            pending = self.inflight.get(key)
+            if pending is None:
+                # Første kall henter verdien, samtidige identiske kall venter på det samme resultatet
+                pending = {"event": threading.Event(), "value": None, "error": None}
+                self.inflight[key] = pending
+                owner = True
+                self.stats[name]["misses"] += 1
+            else:
+                owner = False
+                self.stats[name]["deduplicated"] += 1
+
+        if not owner:
+            pending["event"].wait()
+            if pending["error"] is not None:
+                raise pending["error"]
+            return pending["value"]
+
+        try:
+            value = fetch()
+            error = None
+        except Exception as e:
+            value = None
+            error = e
+
+        with self.lock:
+            if error is None and value:
+                self.entries[key] = (time.monotonic(), value)
+            elif entry is not None and time.monotonic() - entry[0] < policy.get("max_stale", 0):
+                # Oppdateringen feilet, men vi har en ikke altfor gammel verdi å falle tilbake på
+                self.stats[name]["stale"] += 1
+                value, error = entry[1], None
+            del self.inflight[key]
+
+        pending["value"] = value
+        pending["error"] = error
+        pending["event"].set()
+        if error is not None:
+            raise error
+        return value
+
+    def invalidate(self, name=None):
+        with self.lock:
+            for key in list(self.entries):
+                if name is None or key[0] == name:
+                    del self.entries[key]
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(counters) for name, counters in self.stats.items()}
@@ -0,0 +1,92 @@
+from retrieval import BM25Index
+
+# Ekstra søkeord per verktøy, siden beskrivelsene i skjemaene er korte
+TOOL_KEYWORDS = {
+    "get_battery_status": "batteri strøm lading prosent battery charge",
+    "get_wifi_info": "wifi nett nettverk internett tilkobling network",
+    "get_location": "posisjon lokasjon hvor gps kart sted location where map",
+    "get_device_info": "telefon enhet operatør mobilnett device operator",
+    "get_clipboard": "utklippstavle kopiert lim clipboard paste",
+    "set_clipboard": "utklippstavle kopier clipboard copy",
+    "send_sms": "sms melding send svar message text",
+    "send_mms": "mms bilde vedlegg send foto picture attachment",
+    "take_photo": "bilde foto kamera ta photo picture camera",
+    "list_files": "filer mappe liste katalog nyeste største files folder directory",
+    "read_file": "fil les innhold logg søk linjer slutten file read log grep tail",
+    "schedule_task": "planlegg påminnelse minn hver dag daglig kl klokka time minutt intervall senere schedule remind every daily",
+    "list_tasks": "oppgaver planlagte liste tasks scheduled",
+    "cancel_task": "avbryt stopp slett oppgave cancel stop task",
+    "update_memory": "husk lagre notat minne remember note save",
+    "get_agent_stats": "statistikk stats ytelse metrikker svartid tokens cache performance metrics"
+}
+
+REQUEST_TOOLS = {
+    "type": "function",
+    "function": {
+        "name": "request_tools",
+        "description": "Ber om flere verktøy hvis verktøyet du trenger mangler. Oppgi navn eller hva du vil gjøre.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Verktøynavn eller beskrivelse av behovet"}
+            },
+            "required": ["query"]
+        }
+    }
+}
+
+
+def describe_tool(tool):
+    function = tool["function"]
+    parts = [function["name"].replace("_", " "), function.get("description", "")]
+    for name, prop in (function.get("parameters", {}).get("properties") or {}).items():
+        parts.append(f"{name} {prop.get('description', '')}")
+    parts.append(TOOL_KEYWORDS.get(function["name"], ""))
+    return " ".join(parts)
+
+
+# Verktøyene deles i faste nivåer der hvert nivå inneholder det forrige. Skjemaene rendres først i
+# promptet, så et fritt valgt utvalg per instruksjon ville brutt prompt-cachen hver gang. Med faste
+# nivåer finnes bare noen få ulike skjemablokker, og de mindre er prefikser av de større
+class ToolSelector:
+    def __init__(self, tools, tiers=(("send_sms",),), top_k=4):
+        self.tools = tools
+        self.names = [tool["function"]["name"] for tool in tools]
+        self.tiers = []
+        covered = set()
+        for tier in list(tiers) + [self.names]:
+            covered = covered | {name for name in tier if name in self.names}
+            if not self.tiers or covered != self.tiers[-1]:
+                self.tiers.append(covered)
+        rank = {name: next(level for level, tier in enumerate(self.tiers) if name in tier) for name in self.names}
+        self.order = sorted(tools, key=lambda tool: rank[tool["function"]["name"]])
+        self.top_k = top_k
+        self.index = BM25Index()
+        for tool in tools:
+            self.index.add(tool["function"]["name"], describe_tool(tool))
+
+    def tier(self, names):
+        # Minste nivå som dekker alle navnene
+        names = set(names)
+        return set(next(tier for tier in self.tiers if names <= tier))
+
+    def schemas(self, names):
+        # Rekkefølgen følger nivåene, så skjemaene i et lavere nivå alltid kommer først
+        selected = [tool for tool in self.order if tool["function"]["name"] in names]
+        if len(selected) < len(self.tools):
+            selected.append(REQUEST_TOOLS)
+        return selected
+
+    def select(self, instruction):
+        return self.tier(name for name, _ in self.index.search(instruction, self.top_k))
+
+    def expand(self, names, query):
+        query = query or ""
+        added = {name for name in self.names if name in query}
+        if not added:
+            added = {name for name, _ in self.index.search(query, self.top_k)}
+        expanded = self.tier(names | added)
+        if expanded == names:
+            # Fant ikke noe nytt, gi modellen hele verktøysettet
+            expanded = set(self.names)
+        return expanded, sorted(expanded - names)